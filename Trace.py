@@ -279,6 +279,22 @@ class TraceSet():
 
         return Trace(title, data, samples)
 
+    def getTraces(self, firstIndex, count):
+        # read a block of consecutive traces at once, returning the data as a
+        # (count, dataSpace) array and the samples as a (count, samples) array
+        if (self._handle == None):
+            return None
+        count = min(count, self._numberOfTraces - firstIndex)
+        f = self._handle
+        f.seek(self._traceBlockOffset + firstIndex * self._traceSpace)
+
+        record = np.dtype([('title', 'uint8', (self._titleSpace,)),
+                           ('data', 'uint8', (self._dataSpace,)),
+                           ('samples', self._npSampleCoding, (self._numberOfSamplesPerTrace,))])
+        block = np.fromfile(f, dtype=record, count=count)
+
+        return block['data'].reshape(count, self._dataSpace), block['samples'].reshape(count, self._numberOfSamplesPerTrace)
+
     def addTrace(self, trace):
         if (self._handle == None):
             return
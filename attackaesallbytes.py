@@ -0,0 +1,116 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+CPA and LRA attacks on all 16 AES S-boxes in one pass
+
+The traces are loaded and centered once for all the key bytes. The wall time
+of the attacks (without loading) is compared against 16 sequential
+single-byte attacks like in attackaessbox.py on the same traces.
+'''
+
+import numpy as np
+import time
+
+from lracpa import *      # my LRA-CPA toolbox
+from keyrank import *     # full key rank estimation
+
+
+##################################################
+### 0. Configurable parameters
+
+## Traceset, number of traces
+tracesetFilename = "traces/swaes_atmega_power.npz"
+sampleRange      = (800, 1500) # range of samples to attack, in the format (low, high)
+N                = 500 # number of traces to attack (less or equal to the amount of traces in the file)
+offset           = 0   # trace number to start from
+compareSequential = True # also run 16 single-byte attacks for timing comparison
+
+## Leakage model
+## (these parameters correspond to function names in lracpa module)
+intermediateFunction = sBoxOut                  # for CPA and LRA
+leakageFunction      = leakageModelHW           # for CPA
+basisFunctionsModel  = basisModelSingleBits     # for LRA
+
+## Known key for ranking
+knownKey = np.array([0x2B,0x7E,0x15,0x16,0x28,0xAE,0xD2,0xA6,0xAB,0xF7,0x15,0x88,0x09,0xCF,0x4F,0x3C], dtype="uint8")
+
+
+##################################################
+### 1. Log the parameters
+
+print "---\nAttack parameters"
+print "Intermediate function   :", intermediateFunction.__name__
+print "CPA leakage function    :", leakageFunction.__name__
+print "LRA basis functions     :", basisFunctionsModel.__name__
+print "Known roundkey          : 0x%s" % str(bytearray(knownKey)).encode("hex")
+
+
+#################################################
+### 2. Load samples and data, once for all the bytes
+
+print "---\nLoading " + tracesetFilename
+t0 = time.time()
+npzfile = np.load(tracesetFilename)
+data = npzfile['data'][offset:offset + N, 0:16]
+traces = npzfile['traces'][offset:offset + N, sampleRange[0]:sampleRange[1]]
+t1 = time.time()
+
+(numTraces, traceLength) = traces.shape
+print "Number of traces loaded :", numTraces
+print "Trace length            :", traceLength
+print "Loading time            : %0.2f s" % (t1 - t0)
+
+
+#################################################
+### 3. Attack all the bytes in one pass
+
+print "---\nAttack on 16 bytes in one pass"
+
+t0 = time.time()
+CorrPeaks = cpaAESMultiByte(data, traces, intermediateFunction, leakageFunction, peaksOnly=True)
+t1 = time.time()
+R2, coefs = lraAESMultiByte(data, traces, intermediateFunction, basisFunctionsModel)
+R2Peaks = np.max(R2, axis=2)
+t2 = time.time()
+timeCpaMulti = t1 - t0
+timeLraMulti = t2 - t1
+
+for (name, peaks, logProbabilities) in [("CPA", CorrPeaks, correlationLogProbabilities(CorrPeaks, numTraces)),
+                                        ("LRA", R2Peaks, r2LogProbabilities(R2Peaks, numTraces))]:
+    recoveredKey = np.argmax(peaks, axis=1).astype("uint8")
+    ranks = [correctKeyRank(peaks[j], knownKey[j]) for j in range(16)]
+    print name
+    print "Recovered key           : 0x%s" % str(bytearray(recoveredKey)).encode("hex")
+    print "Correct bytes           : %d of 16" % np.count_nonzero(recoveredKey == knownKey)
+    print "Correct candidate ranks : " + " ".join("%d" % r for r in ranks)
+    (rankLow, rankEstimate, rankHigh) = keyRankBounds(logProbabilities, knownKey)
+    print "Full key rank (log2)    : %0.1f, bounds [%0.1f, %0.1f]" % (np.log2(rankEstimate), np.log2(rankLow), np.log2(rankHigh))
+
+print "CPA time                : %0.2f s" % timeCpaMulti
+print "LRA time                : %0.2f s" % timeLraMulti
+
+
+#################################################
+### 4. Sequential single-byte attacks for comparison
+
+if compareSequential:
+
+    print "---\n16 sequential single-byte attacks"
+
+    timeCpaSeq = 0
+    timeLraSeq = 0
+    for SboxNum in range(16):
+        # on the traces loaded above, so that only the attacks are timed as
+        # for the one-pass attack
+        t0 = time.time()
+        CorrTraces = cpaAES(data[:, SboxNum], traces, intermediateFunction, leakageFunction)
+        t1 = time.time()
+        R2, coefs = lraAES(data[:, SboxNum], traces, intermediateFunction, basisFunctionsModel, computeCoefs=False)
+        t2 = time.time()
+        timeCpaSeq += t1 - t0
+        timeLraSeq += t2 - t1
+
+    print "CPA time                : %0.2f s (%0.1f times the one-pass attack)" % (timeCpaSeq, timeCpaSeq / timeCpaMulti)
+    print "LRA time                : %0.2f s (%0.1f times the one-pass attack)" % (timeLraSeq, timeLraSeq / timeLraMulti)
@@ -0,0 +1,78 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+CPA and LRA attacks on all 16 AES S-boxes from one streaming pass over the
+traceset: every chunk of traces is read once and conditionally averaged for
+all the bytes (see ConditionalAveragerAesAllBytes), then the count-weighted
+attacks on the averages give the result on all the traces. The memory taken
+does not depend on the number of traces, so the traceset can be larger than
+the memory.
+'''
+
+import numpy as np
+import time
+
+from lracpa import *      # my LRA-CPA toolbox
+from condaveraes import * # conditional averaging
+from ttest import traceChunks # streaming over tracesets
+from keyrank import *     # full key rank estimation
+
+##################################################
+### 0. Configurable parameters
+
+## Traceset and its reading
+tracesetFilename = "traces/swaes_atmega_power.npz" # or a list of npz files, or a Trace.TraceSet
+sampleRange      = (800, 1500) # range of samples to attack, in the format (low, high)
+chunkSize        = 1000        # number of traces read at once
+precision        = 'float32'   # of the averages, 'float32' takes half the memory
+
+## Leakage model
+## (these parameters correspond to function names in lracpa module)
+intermediateFunction = sBoxOut                  # for CPA and LRA
+leakageFunction      = leakageModelHW           # for CPA
+basisFunctionsModel  = basisModelSingleBits     # for LRA
+
+## Known key for ranking
+knownKey = np.array([0x2B,0x7E,0x15,0x16,0x28,0xAE,0xD2,0xA6,0xAB,0xF7,0x15,0x88,0x09,0xCF,0x4F,0x3C], dtype="uint8")
+
+#################################################
+### 1. One pass over the traceset
+
+print "---\nAveraging " + str(tracesetFilename)
+t0 = time.time()
+CondAver = None
+for (data, traces) in traceChunks(tracesetFilename, chunkSize):
+    if CondAver is None:
+        CondAver = ConditionalAveragerAesAllBytes(traces.shape[1], range(16), sampleRange, precision, keepDeviations=False)
+    CondAver.addTraces(data, traces)
+t1 = time.time()
+numTraces = int(np.sum(CondAver.counters[0]))
+print "Number of traces        :", numTraces
+print "Averaging time          : %0.2f s" % (t1 - t0)
+
+#################################################
+### 2. Attack all the bytes on the averages
+
+CorrPeaks = np.zeros((16, 256))
+R2Peaks = np.zeros((16, 256))
+for SboxNum in range(16):
+    (avdata, avtraces, counts, sumSquares) = CondAver.getWeightedSnapshot(SboxNum)
+    CorrTraces = cpaAES(avdata, avtraces, intermediateFunction, leakageFunction, counts, sumSquares)
+    R2, coefs = lraAES(avdata, avtraces, intermediateFunction, basisFunctionsModel, computeCoefs=False, counts=counts, sumSquares=sumSquares)
+    CorrPeaks[SboxNum] = np.max(np.abs(CorrTraces), axis=1)
+    R2Peaks[SboxNum] = np.max(R2, axis=1)
+t2 = time.time()
+print "Attack time             : %0.2f s" % (t2 - t1)
+
+for (name, peaks, logProbabilities) in [("CPA", CorrPeaks, correlationLogProbabilities(CorrPeaks, numTraces)),
+                                        ("LRA", R2Peaks, r2LogProbabilities(R2Peaks, numTraces))]:
+    recoveredKey = np.argmax(peaks, axis=1).astype("uint8")
+    ranks = [correctKeyRank(peaks[j], knownKey[j]) for j in range(16)]
+    print name
+    print "Recovered key           : 0x%s" % str(bytearray(recoveredKey)).encode("hex")
+    print "Correct bytes           : %d of 16" % np.count_nonzero(recoveredKey == knownKey)
+    print "Correct candidate ranks : " + " ".join("%d" % r for r in ranks)
+    (rankLow, rankEstimate, rankHigh) = keyRankBounds(logProbabilities, knownKey)
+    print "Full key rank (log2)    : %0.1f, bounds [%0.1f, %0.1f]" % (np.log2(rankEstimate), np.log2(rankLow), np.log2(rankHigh))
@@ -15,11 +15,13 @@ In the plots:
 
 import numpy as np
 import matplotlib.pyplot as plt
+import functools
 import time
 
 from aes import AES       # interweb's SlowAES toolbox
 from lracpa import *      # my LRA-CPA toolbox
 from condaveraes import * # incremental conditional averaging
+from checkpoints import * # averager checkpoints
 
 
 ##################################################
@@ -32,6 +34,8 @@ N                = 100 # number of traces to attack (less or equal to the amount
 offset           = 0   # trace number to start from
 evolutionStep    = 10  # step for intermediate reports
 SboxNum          = 2   # S-box to attack, counting from 0
+rankEvolutionFile = None # npz file to save the key rank evolution to, e.g. "results/keyRankEvolutionSbox%02d" % SboxNum
+checkpointDirectory = None # directory of averager checkpoints over whole traces, e.g. "checkpoints"
 
 ## Leakage model
 ## (these parameters correspond to function names in lracpa module)
@@ -85,54 +89,50 @@ print "Loading time            : %0.2f s" % timeLoad
 #################################################
 ### 3. LRA and CPA with evolving amount of traces
 
-print "---\nAttack" 
+print "---\nAttack"
 
 t0 = time.clock()
 
-# initialize the incremental averager
-CondAver = ConditionalAveragerAesSbox(256, traceLength)
-
-# allocate arrays for storing key rank evolution
-numSteps = int(np.ceil(N / np.double(evolutionStep)))
-keyRankEvolutionCPA = np.zeros(numSteps)
-keyRankEvolutionLRA = np.zeros(numSteps)
-
-# the incremental loop
+# key rank evolution of CPA and LRA in one sweep over the traces
 tracesToSkip = 20 # warm-up to avoid numerical problems for small evolution step
-for i in range (0, tracesToSkip - 1):
-    CondAver.addTrace(data[i], traces[i])
-for i in range(tracesToSkip - 1, N):
-    CondAver.addTrace(data[i], traces[i])
-
-    if (((i + 1) % evolutionStep == 0) or ((i + 1) == N)):
-
-        (avdata, avtraces) = CondAver.getSnapshot()
-        
-        CorrTraces = cpaAES(avdata, avtraces, intermediateFunction, leakageFunction)
-        R2, coefs = lraAES(avdata, avtraces, intermediateFunction, basisFunctionsModel)
-
-        print "---\nResults after %d traces" % (i + 1)
-        print "CPA"
-        CorrPeaks = np.max(np.abs(CorrTraces), axis=1) # global maximization, absolute value!
-        CpaWinningCandidate = np.argmax(CorrPeaks)
-        CpaWinningCandidatePeak = np.max(CorrPeaks)
-        CpaCorrectCandidateRank = np.count_nonzero(CorrPeaks >= CorrPeaks[knownKey[SboxNum]])
-        CpaCorrectCandidatePeak = CorrPeaks[knownKey[SboxNum]]
-        print "Winning candidate: 0x%02x, peak magnitude %f" % (CpaWinningCandidate, CpaWinningCandidatePeak)
-        print "Correct candidate: 0x%02x, peak magnitude %f, rank %d" % (knownKey[SboxNum], CpaCorrectCandidatePeak, CpaCorrectCandidateRank)
-
-        print "LRA"
-        R2Peaks = np.max(R2, axis=1) # global maximization
-        LraWinningCandidate = np.argmax(R2Peaks)
-        LraWinningCandidatePeak = np.max(R2Peaks)
-        LraCorrectCandidateRank = np.count_nonzero(R2Peaks >= R2Peaks[knownKey[SboxNum]])
-        LraCorrectCandidatePeak = R2Peaks[knownKey[SboxNum]]
-        print "Winning candidate: 0x%02x, peak magnitude %f" % (LraWinningCandidate, LraWinningCandidatePeak)
-        print "Correct candidate: 0x%02x, peak magnitude %f, rank %d" % (knownKey[SboxNum], LraCorrectCandidatePeak, LraCorrectCandidateRank)
-
-        stepCount = int(np.floor(i / np.double(evolutionStep)))
-        keyRankEvolutionCPA[stepCount] = CpaCorrectCandidateRank
-        keyRankEvolutionLRA[stepCount] = LraCorrectCandidateRank
+traceNumbers = evolutionTraceNumbers(N, evolutionStep, tracesToSkip)
+(traceNumbers, keyRankEvolutionCPA, keyRankEvolutionLRA, CorrPeaksEvolution, R2PeaksEvolution) = \
+    rankEvolutionAES(data, traces, intermediateFunction, leakageFunction, basisFunctionsModel, knownKey[SboxNum], traceNumbers)
+for s in range(len(traceNumbers)):
+    print "%6d traces: CPA rank %3d, LRA rank %3d" % (traceNumbers[s], keyRankEvolutionCPA[s], keyRankEvolutionLRA[s])
+
+# full attack on all the traces, weighting by the counts gives the same
+# result as on non-averaged traces
+if checkpointDirectory is None:
+    CondAver = ConditionalAveragerAesSbox(256, traceLength)
+    CondAver.addTraces(data, traces)
+else:
+    # averages over whole traces from the checkpoint, completed if needed, sliced to the sample range
+    checkpoint = checkpointFilename(tracesetFilename, "byte%d" % SboxNum, directory=checkpointDirectory, firstTrace=offset)
+    CondAver = averageWithCheckpoint(tracesetFilename, checkpoint, functools.partial(ConditionalAveragerAesSbox, 256),
+                                     dataColumns=SboxNum, numTraces=N, firstTrace=offset).sliceSamples(sampleRange)
+(avdata, avtraces, counts, sumSquares) = CondAver.getWeightedSnapshot()
+CorrTraces = cpaAES(avdata, avtraces, intermediateFunction, leakageFunction, counts, sumSquares)
+R2, coefs = lraAES(avdata, avtraces, intermediateFunction, basisFunctionsModel, counts=counts, sumSquares=sumSquares)
+
+print "---\nResults after %d traces" % N
+print "CPA"
+CorrPeaks = np.max(np.abs(CorrTraces), axis=1) # global maximization, absolute value!
+CpaWinningCandidate = np.argmax(CorrPeaks)
+CpaWinningCandidatePeak = np.max(CorrPeaks)
+CpaCorrectCandidateRank = correctKeyRank(CorrPeaks, knownKey[SboxNum])
+CpaCorrectCandidatePeak = CorrPeaks[knownKey[SboxNum]]
+print "Winning candidate: 0x%02x, peak magnitude %f" % (CpaWinningCandidate, CpaWinningCandidatePeak)
+print "Correct candidate: 0x%02x, peak magnitude %f, rank %d" % (knownKey[SboxNum], CpaCorrectCandidatePeak, CpaCorrectCandidateRank)
+
+print "LRA"
+R2Peaks = np.max(R2, axis=1) # global maximization
+LraWinningCandidate = np.argmax(R2Peaks)
+LraWinningCandidatePeak = np.max(R2Peaks)
+LraCorrectCandidateRank = correctKeyRank(R2Peaks, knownKey[SboxNum])
+LraCorrectCandidatePeak = R2Peaks[knownKey[SboxNum]]
+print "Winning candidate: 0x%02x, peak magnitude %f" % (LraWinningCandidate, LraWinningCandidatePeak)
+print "Correct candidate: 0x%02x, peak magnitude %f, rank %d" % (knownKey[SboxNum], LraCorrectCandidatePeak, LraCorrectCandidateRank)
 
 t1 = time.clock()
 timeAll = t1 - t0
@@ -141,7 +141,8 @@ print "---\nCumulative timing"
 print "%0.2f s" % timeAll
 
 # save the rank evolution for later processing
-#np.savez("results/keyRankEvolutionSbox%02d" % SboxNum, kreCPA=keyRankEvolutionCPA, kreLRA=keyRankEvolutionLRA, step=evolutionStep)
+if rankEvolutionFile is not None:
+    saveRankEvolution(rankEvolutionFile, traceNumbers, keyRankEvolutionCPA, keyRankEvolutionLRA)
 
 #################################################
 ### 4. Visualize results
@@ -156,9 +157,6 @@ axLRA = plt.subplot2grid((3, 2), (1, 0))
 axLRAcoefs = plt.subplot2grid((3, 2), (2, 0))
 axRankEvolution = plt.subplot2grid((2, 2), (0, 1), rowspan = 3)
 
-# compute trace nubmers for x axis (TODO: move into block 3)
-traceNumbers = np.arange(evolutionStep, N + 1, evolutionStep)
-
 # CPA
 axCPA.plot(CorrTraces.T, color = 'grey')
 if CpaWinningCandidate != knownKey[SboxNum]:
@@ -176,7 +174,7 @@ axRankEvolution.plot(traceNumbers, keyRankEvolutionLRA, color = 'magenta')
 axLRA.set_xlim([0, traceLength])
 
 # LRA coefs
-coefsKnownKey = np.array(coefs[knownKey[SboxNum]])
+coefsKnownKey = coefs[knownKey[SboxNum]]
 axLRAcoefs.pcolormesh(coefsKnownKey[:,:-1].T, cmap="jet")
 axLRAcoefs.set_xlim([0, traceLength])
 
@@ -191,7 +189,7 @@ axRankEvolution.set_xlabel('Number of traces')
 axRankEvolution.set_title('Correct key rank evolution (global maximisation)')
 
 # Limits and tick labels for key rand evolution plot
-axRankEvolution.set_xlim([traceNumbers[int(np.ceil(tracesToSkip / np.double(evolutionStep))) - 1], N])
+axRankEvolution.set_xlim([traceNumbers[0], N])
 axRankEvolution.set_ylim([0, 256])
 axRankEvolution.grid(b=True, which='both', color='0.65',linestyle='-')
 #axRankEvolution.ticklabel_format(style='sci', axis='x', scilimits=(0,0), useOffset=True)
@@ -0,0 +1,87 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+LRA attack on all 8 DES S-boxes (round in XOR out) with one worker process per
+S-box, see parallelattack module. The wall time is compared against attacking
+the S-boxes one after another.
+'''
+
+import numpy as np
+import time
+
+from desutils import *       # my DES utilities
+from lracpa import *         # my LRA-CPA toolbox
+from parallelattack import * # parallel attack driver
+from keyrank import *        # full key rank estimation
+
+
+##################################################
+### 0. Configurable parameters
+
+tracesetFilename = "traces/hwdes_card8_power.npz"
+sampleRange      = (0, 50) # range of smaples to attack
+N                = 2000    # number of traces to attack (less or equal to the amount of traces in the file)
+processes        = None    # number of worker processes, None for the number of cores
+compareSequential = True   # also attack the S-boxes one after another for timing comparison
+
+averagingFunction    = roundXOR_valueForAveraging
+intermediateFunction = roundXOR_targetVariable
+basisFunctionsModel  = basisModelSingleBits
+
+## Known key for ranking
+knownKey = 0x8A7400A03230DA28
+roundKey = computeRoundKeys(knownKey, 1)[0]
+knownKeyChunks = [roundKeyChunk(roundKey, i) for i in range(8)]
+
+
+if __name__ == "__main__":
+
+    #################################################
+    ### 1. Load samples and data
+
+    print "---\nLoading " + tracesetFilename
+    npzfile = np.load(tracesetFilename)
+    data = npzfile['data'][0:N]
+    traces = npzfile['traces'][0:N,sampleRange[0]:sampleRange[1]]
+
+    # 64-bit inputs, and the 10-bit target variable inputs for each S-box
+    data = desInputs(data)
+    sBoxData = [averagingFunction(data, s) for s in range(8)]
+
+    print "Number of traces loaded :", traces.shape[0]
+    print "Trace length            :", traces.shape[1]
+
+    #################################################
+    ### 2. Attack all the S-boxes in parallel
+
+    print "---\nParallel LRA on 8 S-boxes"
+    t0 = time.time()
+    R2, coefs = attackDESSboxes(lraDES, sBoxData, traces, intermediateFunction, basisFunctionsModel,
+                                processes=processes, computeCoefs=False)
+    t1 = time.time()
+    timeParallel = t1 - t0
+
+    R2Peaks = np.max(R2, axis=2)
+    recoveredChunks = np.argmax(R2Peaks, axis=1)
+    ranks = [correctKeyRank(R2Peaks[s], knownKeyChunks[s]) for s in range(8)]
+    print "Recovered round key     : [ " + " ".join(format(c, '#04x') for c in recoveredChunks) + " ]"
+    print "Known round key         : [ " + " ".join(format(c, '#04x') for c in knownKeyChunks) + " ]"
+    print "Correct candidate ranks : " + " ".join("%d" % r for r in ranks)
+
+    # rank of the 56-bit key, the 8 bits not in the round key are brute-forced
+    (rankLow, rankEstimate, rankHigh) = keyRankBounds(r2LogProbabilities(R2Peaks, traces.shape[0]), knownKeyChunks, extraBits=8)
+    print "Full key rank (log2)    : %0.1f, bounds [%0.1f, %0.1f]" % (np.log2(rankEstimate), np.log2(rankLow), np.log2(rankHigh))
+    print "Time                    : %0.2f s" % timeParallel
+
+    #################################################
+    ### 3. Sequential attacks for comparison
+
+    if compareSequential:
+        print "---\nSequential LRA on 8 S-boxes"
+        t0 = time.time()
+        for s in range(8):
+            R2, coefs = lraDES(sBoxData[s], traces, intermediateFunction, s, basisFunctionsModel, computeCoefs=False)
+        t1 = time.time()
+        print "Time                    : %0.2f s (%0.1f times the parallel attack)" % (t1 - t0, (t1 - t0) / timeParallel)
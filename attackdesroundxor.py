@@ -15,12 +15,13 @@ In the plots:
 
 import numpy as np
 import matplotlib.pyplot as plt
-import struct
+import functools
 import time
 
 from desutils import * # my DES utilities
 from lracpa import * # my LRA-CPA toolbox
 from condaverdes import * # incremental conditional averaging
+from checkpoints import * # averager checkpoints
 
 
 ##################################################
@@ -33,6 +34,8 @@ N                = 10000 # number of traces to attack (less or equal to the amou
 offset           = 0     # trace number to start from
 evolutionStep    = 500   # step for intermediate reports
 SboxNum          = 1     # S-box to attack, counting from 0
+rankEvolutionFile = None # npz file to save the key rank evolution to, e.g. "results/keyRankEvolutionSbox%02d" % SboxNum
+checkpointDirectory = None # directory of averager checkpoints over whole traces, e.g. "checkpoints"
 
 ## Leakage model
 ## (these parameters correspond to function names in lracpa module)
@@ -77,17 +80,14 @@ print ']'
 print "---\nLoading " + tracesetFilename
 t0 = time.clock()
 npzfile = np.load(tracesetFilename)
-data = npzfile['data'][0:N]
-traces = npzfile['traces'][0:N,sampleRange[0]:sampleRange[1]]
+data = npzfile['data'][offset:offset + N]
+traces = npzfile['traces'][offset:offset + N,sampleRange[0]:sampleRange[1]]
 t1 = time.clock()
 timeLoad = t1 - t0
 
-# convert data byte arrays to integers (more convenient for DES)
+# convert data byte arrays to 64-bit integers (more convenient for DES)
 print "Converting data..."
-datanew = []
-for i in range(0, len(data)):
-    datanew.append(struct.unpack('!Q', data[i][0:8].tostring())[0])
-data = datanew # old data will be garbage-collected
+data = desInputs(data)
 
 # Log traceset parameters
 (numTraces, traceLength) = traces.shape
@@ -102,8 +102,7 @@ print "---\nAttack"
 
 # perform conditional averaging
 CondAver = ConditionalAveragerDes(1024, traceLength)
-for i in range(N):
-    CondAver.addTrace(data[i], traces[i], averagingFunction, SboxNum)
+CondAver.addTraces(data, traces, averagingFunction, SboxNum)
 (avdata, avtraces) = CondAver.getSnapshot()
 
 # CPA
@@ -132,7 +131,7 @@ axLRA.plot(R2[knownKeyChunk, :], 'r')
 axLRA.set_xlim([0, traceLength])
 
 # LRA coefs
-coefsKnownKey = np.array(coefs[knownKeyChunk])
+coefsKnownKey = coefs[knownKeyChunk]
 axLRAcoefs.pcolormesh(coefsKnownKey[:,:-1].T, cmap="jet")
 axLRAcoefs.set_xlim([0, traceLength])
 
@@ -152,51 +151,47 @@ print "---\nAttack"
 
 t0 = time.clock()
 
-# initialize the incremental averager
-CondAver = ConditionalAveragerDes(1024, traceLength)
-
-# allocate arrays for storing key rank evolution
-numSteps = int(np.ceil(N / np.double(evolutionStep)))
-keyRankEvolutionCPA = np.zeros(numSteps)
-keyRankEvolutionLRA = np.zeros(numSteps)
-
-# the incremental loop
+# key rank evolution of CPA and LRA in one sweep over the traces
 tracesToSkip = 20 # warm-up to avoid numerical problems for small evolution step
-for i in range (0, tracesToSkip - 1):
-    CondAver.addTrace(data[i], traces[i], averagingFunction, SboxNum)
-for i in range(tracesToSkip - 1, N):
-    CondAver.addTrace(data[i], traces[i], averagingFunction, SboxNum)
-
-    if (((i + 1) % evolutionStep == 0) or ((i + 1) == N)):
-
-        (avdata, avtraces) = CondAver.getSnapshot()
-        
-        CorrTraces = cpaDES(avdata, avtraces, intermediateFunction, SboxNum, leakageFunction)
-        R2, coefs = lraDES(avdata, avtraces, intermediateFunction, SboxNum, basisFunctionsModel)
-        #R2 = normalizeR2Traces(R2)
-
-        print "---\nResults after %d traces" % (i + 1)
-        print "CPA"
-        CorrPeaks = np.max(np.abs(CorrTraces), axis=1) # global maximization, absolute value!
-        CpaWinningCandidate = np.argmax(CorrPeaks)
-        CpaWinningCandidatePeak = np.max(CorrPeaks)
-        CpaCorrectCandidateRank = np.count_nonzero(CorrPeaks >= CorrPeaks[knownKeyChunk])
-        CpaCorrectCandidatePeak = CorrPeaks[knownKeyChunk]
-        print "Winning candidate: 0x%02x, peak magnitude %f" % (CpaWinningCandidate, CpaWinningCandidatePeak)
-        print "Correct candidate: 0x%02x, peak magnitude %f, rank %d" % (knownKeyChunk, CpaCorrectCandidatePeak, CpaCorrectCandidateRank)
-
-        print "LRA"
-        R2Peaks = np.max(R2, axis=1) # global maximization
-        LraWinningCandidate = np.argmax(R2Peaks)
-        LraWinningCandidatePeak = np.max(R2Peaks)
-        LraCorrectCandidateRank = np.count_nonzero(R2Peaks >= R2Peaks[knownKeyChunk])
-        LraCorrectCandidatePeak = R2Peaks[knownKeyChunk]
-        print "Winning candidate: 0x%02x, peak magnitude %f" % (LraWinningCandidate, LraWinningCandidatePeak)
-        print "Correct candidate: 0x%02x, peak magnitude %f, rank %d" % (knownKeyChunk, LraCorrectCandidatePeak, LraCorrectCandidateRank)
-
-        stepCount = int(np.floor(i / np.double(evolutionStep)))
-        keyRankEvolutionCPA[stepCount] = CpaCorrectCandidateRank
-        keyRankEvolutionLRA[stepCount] = LraCorrectCandidateRank
+traceNumbers = evolutionTraceNumbers(N, evolutionStep, tracesToSkip)
+averagingValues = averagingFunction(data, SboxNum)
+(traceNumbers, keyRankEvolutionCPA, keyRankEvolutionLRA, CorrPeaksEvolution, R2PeaksEvolution) = \
+    rankEvolutionDES(averagingValues, traces, intermediateFunction, SboxNum, leakageFunction, basisFunctionsModel, knownKeyChunk, traceNumbers)
+for s in range(len(traceNumbers)):
+    print "%6d traces: CPA rank %3d, LRA rank %3d" % (traceNumbers[s], keyRankEvolutionCPA[s], keyRankEvolutionLRA[s])
+
+# full attack on all the traces, weighting by the counts gives the same
+# result as on non-averaged traces
+if checkpointDirectory is None:
+    CondAver = ConditionalAveragerDes(1024, traceLength)
+    CondAver.addTraces(data, traces, averagingFunction, SboxNum)
+else:
+    # averages over whole traces from the checkpoint, completed if needed, sliced to the sample range
+    checkpoint = checkpointFilename(tracesetFilename, "sbox%d" % SboxNum, averagingFunction, checkpointDirectory, offset)
+    CondAver = averageWithCheckpoint(tracesetFilename, checkpoint, functools.partial(ConditionalAveragerDes, 1024),
+                                     (averagingFunction, SboxNum), numTraces=N, firstTrace=offset).sliceSamples(sampleRange)
+(avdata, avtraces, counts, sumSquares) = CondAver.getWeightedSnapshot()
+CorrTraces = cpaDES(avdata, avtraces, intermediateFunction, SboxNum, leakageFunction, counts, sumSquares)
+R2, coefs = lraDES(avdata, avtraces, intermediateFunction, SboxNum, basisFunctionsModel, counts=counts, sumSquares=sumSquares)
+
+print "---\nResults after %d traces" % N
+print "CPA"
+CorrPeaks = np.max(np.abs(CorrTraces), axis=1) # global maximization, absolute value!
+CpaWinningCandidate = np.argmax(CorrPeaks)
+CpaWinningCandidatePeak = np.max(CorrPeaks)
+CpaCorrectCandidateRank = correctKeyRank(CorrPeaks, knownKeyChunk)
+CpaCorrectCandidatePeak = CorrPeaks[knownKeyChunk]
+print "Winning candidate: 0x%02x, peak magnitude %f" % (CpaWinningCandidate, CpaWinningCandidatePeak)
+print "Correct candidate: 0x%02x, peak magnitude %f, rank %d" % (knownKeyChunk, CpaCorrectCandidatePeak, CpaCorrectCandidateRank)
+
+print "LRA"
+R2Peaks = np.max(R2, axis=1) # global maximization
+LraWinningCandidate = np.argmax(R2Peaks)
+LraWinningCandidatePeak = np.max(R2Peaks)
+LraCorrectCandidateRank = correctKeyRank(R2Peaks, knownKeyChunk)
+LraCorrectCandidatePeak = R2Peaks[knownKeyChunk]
+print "Winning candidate: 0x%02x, peak magnitude %f" % (LraWinningCandidate, LraWinningCandidatePeak)
+print "Correct candidate: 0x%02x, peak magnitude %f, rank %d" % (knownKeyChunk, LraCorrectCandidatePeak, LraCorrectCandidateRank)
 
 t1 = time.clock()
 timeAll = t1 - t0
@@ -205,7 +200,8 @@ print "---\nCumulative timing"
 print "%0.2f s" % timeAll
 
 # save the rank evolution for later processing
-#np.savez("results/keyRankEvolutionSbox%02d" % SboxNum, kreCPA=keyRankEvolutionCPA, kreLRA=keyRankEvolutionLRA, step=evolutionStep)
+if rankEvolutionFile is not None:
+    saveRankEvolution(rankEvolutionFile, traceNumbers, keyRankEvolutionCPA, keyRankEvolutionLRA)
 
 #################################################
 ### 5. Visualize results
@@ -220,9 +216,6 @@ axLRA = plt.subplot2grid((3, 2), (1, 0))
 axLRAcoefs = plt.subplot2grid((3, 2), (2, 0))
 axRankEvolution = plt.subplot2grid((2, 2), (0, 1), rowspan = 3)
 
-# compute trace nubmers for x axis (TODO: move into block 3)
-traceNumbers = np.arange(evolutionStep, N + 1, evolutionStep)
-
 # CPA
 axCPA.plot(CorrTraces.T, color = 'grey')
 if CpaWinningCandidate != knownKeyChunk:
@@ -240,7 +233,7 @@ axRankEvolution.plot(traceNumbers, keyRankEvolutionLRA, color = 'magenta')
 axLRA.set_xlim([0, traceLength])
 
 # LRA coefs
-coefsKnownKey = np.array(coefs[knownKeyChunk])
+coefsKnownKey = coefs[knownKeyChunk]
 axLRAcoefs.pcolormesh(coefsKnownKey[:,:-1].T, cmap="jet")
 axLRAcoefs.set_xlim([0, traceLength])
 
@@ -255,7 +248,7 @@ axRankEvolution.set_xlabel('Number of traces')
 axRankEvolution.set_title('Correct key rank evolution (global maximisation)')
 
 # Limits and tick labels for key rand evolution plot
-axRankEvolution.set_xlim([traceNumbers[int(np.ceil(tracesToSkip / np.double(evolutionStep))) - 1], N])
+axRankEvolution.set_xlim([traceNumbers[0], N])
 axRankEvolution.set_ylim([0, 64])
 axRankEvolution.grid(b=True, which='both', color='0.65',linestyle='-')
 #axRankEvolution.ticklabel_format(style='sci', axis='x', scilimits=(0,0), useOffset=True)
@@ -0,0 +1,92 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Conditional averaging of a traceset split in several files (shards), one
+worker process per file, see averageTracesets in parallelattack module. The
+averagers of the shards are merged, and CPA and LRA are run on the result.
+The wall time is compared against averaging the files one after another.
+
+For the example, the shards are cut from the AES traceset if not there yet.
+'''
+
+import numpy as np
+import functools
+import os
+import time
+
+from lracpa import *         # my LRA-CPA toolbox
+from condaveraes import *    # conditional averaging
+from parallelattack import * # parallel driver
+from ttest import traceChunks
+
+
+##################################################
+### 0. Configurable parameters
+
+tracesetFilename  = "traces/swaes_atmega_power.npz" # source of the example shards
+numShards         = 4
+shardFilenames    = ["traces/swaes_atmega_power_shard%d.npz" % i for i in range(numShards)] # .npz or .trs
+sampleRange       = (950, 1150) # range of samples to average, in the format (low, high)
+chunkSize         = 1000    # number of traces read at once
+processes         = None    # number of worker processes, None for the number of cores
+compareSequential = True    # also average the shards one after another for comparison
+SboxNum           = 0       # S-box to attack, counting from 0
+
+intermediateFunction = sBoxOut                  # for CPA and LRA
+leakageFunction      = leakageModelHW           # for CPA
+basisFunctionsModel  = basisModelSingleBits     # for LRA
+
+knownKey = np.array([0x2B,0x7E,0x15,0x16,0x28,0xAE,0xD2,0xA6,0xAB,0xF7,0x15,0x88,0x09,0xCF,0x4F,0x3C], dtype="uint8")
+
+
+if __name__ == "__main__":
+
+    #################################################
+    ### 1. Shards of the example traceset
+
+    if not all(os.path.exists(f) for f in shardFilenames):
+        print "---\nCutting %d shards from %s" % (numShards, tracesetFilename)
+        npzfile = np.load(tracesetFilename)
+        bounds = np.linspace(0, len(npzfile['traces']), numShards + 1).astype(int)
+        for i in range(numShards):
+            np.savez(shardFilenames[i], data=npzfile['data'][bounds[i]:bounds[i + 1]], traces=npzfile['traces'][bounds[i]:bounds[i + 1]])
+
+    #################################################
+    ### 2. Average the shards in parallel
+
+    print "---\nParallel averaging of %d shards" % len(shardFilenames)
+    t0 = time.time()
+    CondAver = averageTracesets(shardFilenames, functools.partial(ConditionalAveragerAesSbox, 256), dataColumns=SboxNum,
+                                chunkSize=chunkSize, sampleRange=sampleRange, processes=processes)
+    t1 = time.time()
+    timeParallel = t1 - t0
+    print "Number of traces        : %d" % np.sum(CondAver.counters)
+    print "Time                    : %0.2f s" % timeParallel
+
+    #################################################
+    ### 3. Sequential averaging for comparison
+
+    if compareSequential:
+        print "---\nSequential averaging"
+        t0 = time.time()
+        CondAverSeq = ConditionalAveragerAesSbox(256, sampleRange[1] - sampleRange[0])
+        for (data, traces) in traceChunks(shardFilenames, chunkSize, sampleRange):
+            CondAverSeq.addTraces(data[:, SboxNum], traces)
+        t1 = time.time()
+        timeSequential = t1 - t0
+        print "Time                    : %0.2f s (%0.1f times the parallel averaging)" % (timeSequential, timeSequential / timeParallel)
+        print "Max difference of averages: %g" % np.max(np.abs(CondAver.getSnapshot()[1] - CondAverSeq.getSnapshot()[1]))
+
+    #################################################
+    ### 4. Attack on the merged averages
+
+    (avdata, avtraces, counts, sumSquares) = CondAver.getWeightedSnapshot()
+    CorrTraces = cpaAES(avdata, avtraces, intermediateFunction, leakageFunction, counts, sumSquares)
+    R2, coefs = lraAES(avdata, avtraces, intermediateFunction, basisFunctionsModel, computeCoefs=False, counts=counts, sumSquares=sumSquares)
+    CorrPeaks = np.max(np.abs(CorrTraces), axis=1)
+    R2Peaks = np.max(R2, axis=1)
+    print "---\nResults"
+    print "CPA correct candidate rank : %d" % correctKeyRank(CorrPeaks, knownKey[SboxNum])
+    print "LRA correct candidate rank : %d" % correctKeyRank(R2Peaks, knownKey[SboxNum])
@@ -0,0 +1,155 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Checkpoints of the conditional averagers. Averaging is the only step touching
+all the traces, so its state over whole traces (per-value sums and counts, the
+sum of squared traces and optionally the per-value sums of squared deviations)
+is saved to an npz file, keyed by the traceset (its file name and a hash of
+its absolute path, so that tracesets of the same name in different
+directories do not share checkpoints), the byte or S-box, the averaging
+function and the first trace averaged. A later attack with another sample window or model only
+loads the checkpoint and slices the window (see sliceSamples of the
+averagers), and the checkpoint of a traceset that grew is completed with the
+new traces only. The traces are assumed to be only appended to a traceset.
+
+Usage example:
+    checkpoint = checkpointFilename("traces/swaes_atmega_power.npz", "byte0")
+    CondAver = averageWithCheckpoint("traces/swaes_atmega_power.npz", checkpoint,
+                                     functools.partial(ConditionalAveragerAesSbox, 256), dataColumns=0)
+    (avdata, avtraces, counts, sumSquares) = CondAver.sliceSamples((950, 1150)).getWeightedSnapshot()
+'''
+
+import os
+import hashlib
+import numpy as np
+
+from condaveraes import ConditionalAveragerAesSbox
+from condaverdes import ConditionalAveragerDes
+from ttest import traceChunks
+
+# averager classes that can be saved, by name
+averagerClasses = dict((c.__name__, c) for c in [ConditionalAveragerAesSbox, ConditionalAveragerDes])
+
+
+# Identifier of a traceset: its file name without extension and the first
+# digits of the MD5 hash of its absolute path (not of the contents or the
+# size, which change as traces are appended)
+def tracesetId(tracesetFilename):
+    path = os.path.abspath(tracesetFilename)
+    digest = hashlib.md5(path if isinstance(path, bytes) else path.encode('utf-8')).hexdigest()
+    return "%s_%s" % (os.path.splitext(os.path.basename(path))[0], digest[:8])
+
+# Name of the checkpoint file for a traceset and target
+# tracesetFilename - file name of the traceset
+# target           - what is averaged, e.g. "byte0" or "sbox3"
+# function         - averaging function (or its name), e.g. for DES
+# directory        - directory of the checkpoints
+# firstTrace       - number of the first trace averaged
+def checkpointFilename(tracesetFilename, target, function=None, directory="checkpoints", firstTrace=0):
+    name = tracesetId(tracesetFilename) + "_" + str(target)
+    if function is not None:
+        name += "_" + getattr(function, '__name__', str(function))
+    if firstTrace != 0:
+        name += "_from%d" % firstTrace
+    return os.path.join(directory, name + ".npz")
+
+# String identifying what is averaged, stored in the checkpoint and checked
+# on loading, see averageWithCheckpoint for the parameters
+def checkpointKey(tracesetFilename, dataColumns, addArgs, firstTrace=0):
+    args = ",".join(getattr(a, '__name__', str(a)) for a in addArgs)
+    return "%s|%s|%s|%d" % (tracesetId(tracesetFilename), dataColumns, args, firstTrace)
+
+# Save an averager to a checkpoint file, replacing the previous one only once
+# written completely
+# filename      - checkpoint file name, see checkpointFilename
+# averager      - ConditionalAveragerAesSbox or ConditionalAveragerDes
+# numTraces     - number of traces of the traceset averaged, from the first
+#                 trace of the key
+# key           - string identifying what is averaged, see checkpointKey
+# secondMoments - if False, the per-value sums of squared deviations (for snr
+#                 and nicv) are not saved, halving the size of the file
+def saveCheckpoint(filename, averager, numTraces, key="", secondMoments=True):
+    arrays = {'sums': averager.sums, 'counters': averager.counters, 'sumSquares': averager.sumSquares}
+    if secondMoments and averager.sumSquaredDeviations is not None:
+        arrays['sumSquaredDeviations'] = averager.sumSquaredDeviations
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary = filename + ".tmp"
+    with open(temporary, 'wb') as f:
+        np.savez(f, averagerClass=averager.__class__.__name__, numTraces=numTraces, key=key, **arrays)
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temporary, filename)
+
+# Load an averager from a checkpoint file
+# filename - checkpoint file name
+# key      - if given, the key the checkpoint must have been saved with
+# returns the averager and the number of traces averaged
+def loadCheckpoint(filename, key=None):
+    npzfile = np.load(filename)
+    if key is not None and str(npzfile['key']) != key:
+        raise ValueError("checkpoint %s is for %s, not for %s" % (filename, npzfile['key'], key))
+    averager = averagerClasses[str(npzfile['averagerClass'])](*npzfile['sums'].shape)
+    averager.sums = npzfile['sums']
+    averager.counters = npzfile['counters']
+    averager.sumSquares = npzfile['sumSquares']
+    if 'sumSquaredDeviations' in npzfile.files:
+        averager.sumSquaredDeviations = npzfile['sumSquaredDeviations']
+    else:
+        averager.sumSquaredDeviations = None
+    return averager, int(npzfile['numTraces'])
+
+# Conditional averaging of a traceset resumed from a checkpoint: the averager
+# of the checkpoint is completed with the traces appended to the traceset
+# since it was saved (or computed from scratch if there is no checkpoint yet),
+# and saved again
+# tracesetFilename - trs or npz file name
+# checkpoint       - checkpoint file name, see checkpointFilename
+# newAverager      - function of the trace length returning an empty averager,
+#                    e.g. functools.partial(ConditionalAveragerAesSbox, 256)
+# addArgs          - further arguments of the addTraces of the averager, e.g.
+#                    (roundXOR_valueForAveraging, sBoxNumber) for ConditionalAveragerDes
+# dataColumns      - columns of the data passed to addTraces, e.g. the byte
+#                    number for ConditionalAveragerAesSbox, None for all the data
+# numTraces        - number of traces to average from firstTrace, None for all;
+#                    a checkpoint over more traces is not used (nor replaced)
+# firstTrace       - number of the first trace to average (e.g. the offset of
+#                    an attack), part of the key of the checkpoint
+# chunkSize        - number of traces read at once
+# saveInterval     - if given, the checkpoint is also saved after every so
+#                    many traces, so that an interrupted run can be resumed
+# secondMoments    - see saveCheckpoint
+# returns the averager over whole traces (None for an empty traceset), to
+# slice with sliceSamples
+def averageWithCheckpoint(tracesetFilename, checkpoint, newAverager, addArgs=(), dataColumns=None, numTraces=None,
+                          firstTrace=0, chunkSize=1000, saveInterval=None, secondMoments=True):
+    key = checkpointKey(tracesetFilename, dataColumns, addArgs, firstTrace)
+    (averager, tracesDone) = (None, 0)
+    if os.path.exists(checkpoint):
+        (averager, tracesDone) = loadCheckpoint(checkpoint, key)
+        if numTraces is not None and tracesDone > numTraces:
+            (averager, tracesDone, checkpoint) = (None, 0, None)
+
+    tracesSinceSave = 0
+    for (data, traces) in traceChunks(tracesetFilename, chunkSize, None, firstTrace + tracesDone):
+        if numTraces is not None:
+            if tracesDone >= numTraces:
+                break
+            (data, traces) = (data[:numTraces - tracesDone], traces[:numTraces - tracesDone])
+        if averager is None:
+            averager = newAverager(traces.shape[1])
+        if dataColumns is not None:
+            data = data[:, dataColumns]
+        averager.addTraces(data, traces, *addArgs)
+        tracesDone += len(traces)
+        tracesSinceSave += len(traces)
+        if checkpoint is not None and saveInterval is not None and tracesSinceSave >= saveInterval:
+            saveCheckpoint(checkpoint, averager, tracesDone, key, secondMoments)
+            tracesSinceSave = 0
+
+    if checkpoint is not None and tracesSinceSave > 0:
+        saveCheckpoint(checkpoint, averager, tracesDone, key, secondMoments)
+    return averager
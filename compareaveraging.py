@@ -0,0 +1,60 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Benchmark of conditional averaging on random traces: the per-trace loop over
+addTrace against the batch addTraces of the averager (in chunks) and the
+one-shot conditionalAveragingAESSbox
+'''
+
+import numpy as np
+import time
+
+from condaveraes import * # conditional averaging
+
+##################################################
+### 0. Configurable parameters
+
+N           = 100000 # number of traces
+traceLength = 200    # number of samples per trace
+chunkSize   = 10000  # number of traces per addTraces call
+
+data = np.random.randint(0, 256, N).astype('uint8')
+traces = np.random.randint(-128, 128, (N, traceLength)).astype('int8')
+
+##################################################
+### 1. Compare
+
+# per-trace loop
+t0 = time.clock()
+CondAverLoop = ConditionalAveragerAesSbox(256, traceLength)
+for i in range(N):
+    CondAverLoop.addTrace(data[i], traces[i])
+t1 = time.clock()
+timeLoop = t1 - t0
+
+# batches
+t0 = time.clock()
+CondAver = ConditionalAveragerAesSbox(256, traceLength)
+for first in range(0, N, chunkSize):
+    CondAver.addTraces(data[first:first + chunkSize], traces[first:first + chunkSize])
+t1 = time.clock()
+timeBatch = t1 - t0
+
+# one shot
+t0 = time.clock()
+(avdata, avtraces) = conditionalAveragingAESSbox(data, traces)
+t1 = time.clock()
+timeOneShot = t1 - t0
+
+print "Per-trace addTrace      : %0.2f s" % timeLoop
+print "addTraces by %6d    : %0.2f s (%0.1f times faster)" % (chunkSize, timeBatch, timeLoop / timeBatch)
+print "One-shot averaging      : %0.2f s (%0.1f times faster)" % (timeOneShot, timeLoop / timeOneShot)
+
+(avdataLoop, avtracesLoop) = CondAverLoop.getSnapshot()
+print "Max difference of averages  : %g, %g" % (np.max(np.abs(CondAver.getSnapshot()[1] - avtracesLoop)), np.max(np.abs(avtraces - avtracesLoop)))
+print "Max difference of SNR       : %g" % np.max(np.abs(CondAver.snr() - CondAverLoop.snr()))
+print "Max rel. diff. of sumSquares: %g" % np.max(np.abs(CondAver.sumSquares / CondAverLoop.sumSquares - 1))
+if not (np.array_equal(avdata, avdataLoop) and np.array_equal(CondAver.counters, CondAverLoop.counters)):
+    print "Fail!"
@@ -0,0 +1,52 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Benchmark of computing the DES values for conditional averaging (round in XOR
+out) on random plaintexts: per-plaintext struct.unpack and bitwise initial
+permutation against the numpy path over uint64 arrays (see desutils)
+'''
+
+import numpy as np
+import struct
+import time
+
+from desutils import *    # my DES utilities
+
+##################################################
+### 0. Configurable parameters
+
+N         = 1000000 # number of plaintexts
+NScalar   = 20000   # number of plaintexts for the per-plaintext loop (extrapolated to N)
+
+data = np.random.randint(0, 256, (N, 8)).astype('uint8')
+
+##################################################
+### 1. Compare
+
+# per plaintext, one S-box
+t0 = time.time()
+inputs = [struct.unpack('!Q', d[0:8].tostring())[0] for d in data[0:NScalar]]
+valuesScalar = np.array([roundXOR_valueForAveraging(d, 0) for d in inputs])
+t1 = time.time()
+timeScalar = (t1 - t0) * N / NScalar
+
+# whole array, all 8 S-boxes (the first call includes building the lookup tables)
+t0 = time.time()
+initialPermutationArray(np.zeros(1, dtype='uint64'))
+t1 = time.time()
+inputsArray = desInputs(data)
+values = roundXOR_valueForAveragingAllSboxes(inputsArray)
+t2 = time.time()
+
+# whole array, one S-box
+valuesOne = roundXOR_valueForAveraging(inputsArray, 0)
+t3 = time.time()
+
+print "Per plaintext, 1 S-box  : %0.2f s (extrapolated from %d plaintexts)" % (timeScalar, NScalar)
+print "Lookup tables           : %0.3f s (once)" % (t1 - t0)
+print "Arrays, 8 S-boxes       : %0.3f s (%0.0f times faster per S-box)" % (t2 - t1, timeScalar * 8 / (t2 - t1))
+print "Arrays, 1 S-box         : %0.3f s" % (t3 - t2)
+if not (np.array_equal(values[0, 0:NScalar], valuesScalar) and np.array_equal(valuesOne, values[0])):
+    print "Fail!"
@@ -0,0 +1,55 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Micro-benchmark of building the CPA leakage hypotheses for all 256 key
+candidates: per-candidate loop over the intermediate function followed by the
+leakage function (as cpaAES used to do) against one gather from the compiled
+(data, key) -> leakage table
+'''
+
+import numpy as np
+import time
+
+from lracpa import *   # my LRA-CPA toolbox
+
+##################################################
+### 0. Configurable parameters
+
+N           = 10000 # number of traces (data bytes)
+repetitions = 20    # number of times each method is run
+
+intermediateFunctions = [sBoxOut, sBoxInXorOut, invSboxOut, invSboxInXorOut]
+leakageFunction       = leakageModelHW
+
+data = np.random.randint(0, 256, N).astype('uint8')
+k = np.arange(0, 256, dtype='uint8')
+
+##################################################
+### 1. Compare
+
+for intermediateFunction in intermediateFunctions:
+
+    # loop over the candidates
+    t0 = time.clock()
+    for r in range(repetitions):
+        H = np.zeros((256, N), dtype='uint8')
+        for i in range(256):
+            H[i,:] = intermediateFunction(data, k[i])
+        HLloop = np.array(map(leakageFunction, H)).T
+    t1 = time.clock()
+    timeLoop = (t1 - t0) / repetitions
+
+    # table compilation (once) and gather
+    t0 = time.clock()
+    table = hypothesisTableAES(intermediateFunction, leakageFunction)
+    t1 = time.clock()
+    for r in range(repetitions):
+        HL = hypothesisTableAES(intermediateFunction, leakageFunction)[data]
+    t2 = time.clock()
+    timeGather = (t2 - t1) / repetitions
+
+    print "%-16s: loop %0.2f ms, table compilation %0.2f ms, gather %0.2f ms (%0.1f times faster)" % (intermediateFunction.__name__, timeLoop * 1e3, (t1 - t0) * 1e3, timeGather * 1e3, timeLoop / timeGather)
+    if not np.array_equal(HL, HLloop):
+        print "Fail!"
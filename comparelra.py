@@ -0,0 +1,91 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Check the LRA implementation from lracpa against the straightforward
+per-sample regression loop, on the example AES and DES tracesets.
+Reports the timing of both and the maximum deviation of R2.
+'''
+
+import numpy as np
+import struct
+import time
+
+from lracpa import *      # my LRA-CPA toolbox
+from desutils import *    # my DES utilities
+
+
+##################################################
+### 0. Configurable parameters
+
+aesTracesetFilename = "traces/swaes_atmega_power.npz"
+aesSampleRange      = (950, 1150) # range of samples to attack, in the format (low, high)
+aesN                = 500         # number of traces to attack
+aesSboxNum          = 0           # S-box to attack, counting from 0
+
+desTracesetFilename = "traces/hwdes_card8_power.npz"
+desSampleRange      = (0, 50)     # range of samples to attack, in the format (low, high)
+desN                = 500         # number of traces to attack
+desSboxNum          = 1           # S-box to attack, counting from 0
+
+basisFunctionsModel = basisModelSingleBitsAndPairs
+tolerance           = 1e-9        # maximum allowed absolute deviation of R2
+
+
+##################################################
+### 1. Reference implementation: one regression per time sample
+
+def lraReference(intermediateVariables, traces, basisFunctionsModel, bitWidth):
+    (numTraces, traceLength) = traces.shape
+    SStot = np.sum((traces - np.mean(traces, 0)) ** 2, 0)
+    SSreg = np.empty((len(intermediateVariables), traceLength))
+    for k in range(len(intermediateVariables)):
+        M = np.array([basisFunctionsModel(x, bitWidth) for x in intermediateVariables[k]])
+        P = np.dot(np.linalg.inv(np.dot(M.T, M)), M.T)
+        for u in range(0, traceLength):
+            beta = np.dot(P, traces[:,u])
+            E = np.dot(M, beta)
+            SSreg[k,u] = np.sum((E - traces[:,u]) ** 2)
+    return 1 - SSreg / SStot[None, :]
+
+def compare(name, R2, R2ref, timeNew, timeRef):
+    deviation = np.max(np.abs(R2 - R2ref))
+    print "%s: reference %0.2f s, lracpa %0.2f s, max R2 deviation %g" % (name, timeRef, timeNew, deviation)
+    if deviation > tolerance:
+        print "Fail!"
+    else:
+        print "Success!"
+
+
+##################################################
+### 2. AES S-box out
+
+npzfile = np.load(aesTracesetFilename)
+data = npzfile['data'][0:aesN, aesSboxNum]
+traces = npzfile['traces'][0:aesN, aesSampleRange[0]:aesSampleRange[1]].astype('float64')
+
+t0 = time.clock()
+intermediateVariables = [sBoxOut(data, k) for k in np.arange(0, 256, dtype='uint8')]
+R2ref = lraReference(intermediateVariables, traces, basisFunctionsModel, 8)
+t1 = time.clock()
+(R2, coefs) = lraAES(data, traces, sBoxOut, basisFunctionsModel)
+t2 = time.clock()
+compare("AES", R2, R2ref, t2 - t1, t1 - t0)
+
+
+##################################################
+### 3. DES round in XOR out
+
+npzfile = np.load(desTracesetFilename)
+data = [struct.unpack('!Q', d[0:8].tostring())[0] for d in npzfile['data'][0:desN]]
+traces = npzfile['traces'][0:desN, desSampleRange[0]:desSampleRange[1]].astype('float64')
+
+t0 = time.clock()
+data = [roundXOR_valueForAveraging(d, desSboxNum) for d in data]
+intermediateVariables = [[roundXOR_targetVariable(d, k, desSboxNum) for d in data] for k in range(64)]
+R2ref = lraReference(intermediateVariables, traces, basisFunctionsModel, 4)
+t1 = time.clock()
+(R2, coefs) = lraDES(data, traces, roundXOR_targetVariable, desSboxNum, basisFunctionsModel)
+t2 = time.clock()
+compare("DES", R2, R2ref, t2 - t1, t1 - t0)
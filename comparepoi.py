@@ -0,0 +1,62 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Compare LRA on the whole sample range against LRA on the points of interest
+selected by SNR, CPA envelope and variance (see poi module), on the AES traceset
+'''
+
+import numpy as np
+import time
+
+from lracpa import *   # my LRA-CPA toolbox
+from poi import *      # point-of-interest selection
+
+##################################################
+### 0. Configurable parameters
+
+tracesetFilename = "traces/swaes_atmega_power.npz"
+sampleRange      = (0, 2800) # range of samples to select from
+N                = 500       # number of traces
+SboxNum          = 0         # S-box to attack, counting from 0
+budget           = 0.05      # fraction of the samples to keep
+
+basisFunctionsModel = basisModelSingleBits
+knownKey = np.array([0x2B,0x7E,0x15,0x16,0x28,0xAE,0xD2,0xA6,0xAB,0xF7,0x15,0x88,0x09,0xCF,0x4F,0x3C], dtype="uint8")
+
+##################################################
+### 1. Load
+
+npzfile = np.load(tracesetFilename)
+data = npzfile['data'][0:N, SboxNum]
+traces = npzfile['traces'][0:N, sampleRange[0]:sampleRange[1]]
+
+def report(name, R2, timeSelect, timeLRA, numSamples):
+    R2Peaks = np.max(R2, axis=1)
+    rank = correctKeyRank(R2Peaks, knownKey[SboxNum])
+    print "%-12s: %4d samples, selection %0.2f s, LRA %0.2f s, correct key rank %d, peak R2 %f" % (name, numSamples, timeSelect, timeLRA, rank, R2Peaks[knownKey[SboxNum]])
+
+##################################################
+### 2. Full range
+
+t0 = time.time()
+R2, coefs = lraAES(data, traces, sBoxOut, basisFunctionsModel, computeCoefs=False)
+t1 = time.time()
+report("full range", R2, 0, t1 - t0, traces.shape[1])
+
+##################################################
+### 3. Selected points of interest
+
+selectors = [("SNR",          lambda: snrScores(data, traces, 256)),
+             ("CPA envelope", lambda: cpaEnvelopeScores(cpaAESWalsh(data, traces, sBoxOut, leakageModelHW))),
+             ("variance",     lambda: varianceScores(traces))]
+
+for (name, scoreFunction) in selectors:
+    t0 = time.time()
+    indices = selectSamples(scoreFunction(), budget)
+    t1 = time.time()
+    R2, coefs = lraAES(data, traces[:, indices], sBoxOut, basisFunctionsModel, computeCoefs=False)
+    t2 = time.time()
+    report(name, R2, t1 - t0, t2 - t1, len(indices))
+    print "%-12s  windows %s" % ("", sampleWindows(indices + sampleRange[0], sampleRange[1], gap=10)[:5])
@@ -0,0 +1,47 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Compare performance and accuracy of the CPA precision paths (float32 and exact
+integer accumulation) against the float64 reference, on the int8 AES traceset
+'''
+
+import numpy as np
+import time
+
+from lracpa import *   # my LRA-CPA toolbox
+
+##################################################
+### 0. Configurable parameters
+
+tracesetFilename = "traces/swaes_atmega_power.npz"
+sampleRange      = (0, 2800) # range of samples to attack, in the format (low, high)
+N                = 2000      # number of traces to attack
+SboxNum          = 0         # S-box to attack, counting from 0
+
+##################################################
+### 1. Load samples and data, keeping the stored sample type
+
+npzfile = np.load(tracesetFilename)
+data = npzfile['data'][0:N, SboxNum]
+traces = npzfile['traces'][0:N, sampleRange[0]:sampleRange[1]]
+print "Traces: %d x %d, %s" % (traces.shape[0], traces.shape[1], traces.dtype)
+
+# integer leakage hypotheses for all key candidates
+k = np.arange(0, 256, dtype='uint8')
+HL = np.array([leakageModelHW(sBoxOut(data, ki)) for ki in k]).T
+
+##################################################
+### 2. Run and compare
+
+t0 = time.clock()
+CorrTracesRef = correlationTraces(traces, HL)
+t1 = time.clock()
+print "float64 : %0.3f s" % (t1 - t0)
+
+for precision in ['float32', 'exact']:
+    t0 = time.clock()
+    CorrTraces = correlationTraces(traces, HL, precision)
+    t1 = time.clock()
+    print "%-8s: %0.3f s, max deviation from float64 %g" % (precision, t1 - t0, np.max(np.abs(CorrTraces - CorrTracesRef)))
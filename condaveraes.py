@@ -6,30 +6,222 @@ Version: 1.0, 2017-05-14
 Conditional averaging for AES. Very rough so far.
 
 TODO: 
-- iterator (therefore loop inside)
 - automatic readout from a file
 '''
 
 import numpy as np
 
+from lracpa import conditionalSums, conditionalMoments
+
 class ConditionalAveragerAesSbox:
 
     def __init__(self, numValues, traceLength):
-        '''Allocate the matrix of averaged traces'''
-        self.avtraces = np.zeros((numValues, traceLength))
+        '''Allocate the sums of traces per value'''
+        self.sums = np.zeros((numValues, traceLength))
         self.counters = np.zeros(numValues)
+        self.sumSquares = np.zeros(traceLength) # sum of squared traces, for weighted CPA/LRA
+        self.sumSquaredDeviations = np.zeros((numValues, traceLength)) # per value, from its average
         print 'ConditionalAverager: initialized for %d values and trace length %d' % (numValues, traceLength)
 
     def addTrace(self, data, trace):
         '''Add a single trace with corresponding single chunk of data'''
-        if (self.counters[data] == 0):
-            self.avtraces[data] = trace
-        else:
-            self.avtraces[data] = self.avtraces[data] + (trace - self.avtraces[data]) / self.counters[data]
+        delta = trace - self.sums[data] / max(self.counters[data], 1)
         self.counters[data] += 1
+        self.sums[data] += trace
+        if self.sumSquaredDeviations is not None:
+            self.sumSquaredDeviations[data] += delta * (trace - self.sums[data] / self.counters[data]) # Welford's update
+        self.sumSquares += np.square(trace, dtype='float64')
+
+    def addTraces(self, data, traces):
+        '''Add a batch of traces with the corresponding data, grouping the
+           traces by value at once instead of a call of addTrace per trace'''
+        (counts, sums, sumSquaredDeviations) = conditionalMoments(data, traces, len(self.counters))
+        self.mergeMoments(counts, sums, sumSquaredDeviations)
+        observed = np.flatnonzero(counts)
+        self.sumSquares += np.sum(sumSquaredDeviations, axis=0) + np.dot(1 / counts[observed], np.square(sums[observed]))
+
+    def mergeMoments(self, counts, sums, sumSquaredDeviations):
+        '''Merge per-value counts, sums and sums of squared deviations of a
+           batch of traces (see conditionalMoments in lracpa) into these,
+           with the pairwise update of Chan et al. for the deviations'''
+        observed = np.flatnonzero(counts)
+        na = self.counters[observed]
+        nb = counts[observed]
+        n = na + nb
+        if sumSquaredDeviations is None:
+            self.sumSquaredDeviations = None # not known for the merged traces any more
+        if self.sumSquaredDeviations is not None:
+            delta = sums[observed] / nb[:, None] - self.sums[observed] / np.maximum(na, 1)[:, None]
+            self.sumSquaredDeviations[observed] += sumSquaredDeviations[observed] + np.square(delta) * (na * nb / n)[:, None]
+        self.sums[observed] += sums[observed]
+        self.counters[observed] = n
+
+    def merge(self, other):
+        '''Merge the averager of another set of traces (e.g. another shard of
+           the traceset, averaged in another process) into this one'''
+        self.mergeMoments(other.counters, other.sums, other.sumSquaredDeviations)
+        self.sumSquares += other.sumSquares
+
+    def sliceSamples(self, sampleRange):
+        '''Return a copy of the averager for the samples in sampleRange
+           (low, high) only, e.g. to attack a window of a checkpoint over
+           whole traces (see checkpoints module)'''
+        (low, high) = sampleRange
+        window = ConditionalAveragerAesSbox(len(self.counters), high - low)
+        window.sums = self.sums[:, low:high].copy()
+        window.counters = self.counters.copy()
+        window.sumSquares = self.sumSquares[low:high].copy()
+        if self.sumSquaredDeviations is None:
+            window.sumSquaredDeviations = None
+        else:
+            window.sumSquaredDeviations = self.sumSquaredDeviations[:, low:high].copy()
+        return window
 
     def getSnapshot(self):
         ''' return a snapshot of the average matrix'''
         avdataSnap = np.flatnonzero(self.counters)   # get an vector of only _observed_ values
-        avtracesSnap = self.avtraces[avdataSnap] # remove lines corresponding to non-observed values
+        avtracesSnap = self.sums[avdataSnap] / self.counters[avdataSnap, None]
+        return avdataSnap, avtracesSnap
+
+    def getWeightedSnapshot(self):
+        ''' return a snapshot of the average matrix together with the number of
+            traces behind every average and the sum of squared traces, for exact
+            weighted CPA/LRA (see counts and sumSquares in lracpa)'''
+        avdataSnap, avtracesSnap = self.getSnapshot()
+        return avdataSnap, avtracesSnap, self.counters[avdataSnap], self.sumSquares.copy()
+
+    def getSignalAndNoise(self):
+        ''' return the per-sample variance of the averages (signal) and the
+            average variance within the values (noise), both weighted by
+            the number of traces per value'''
+        n = np.sum(self.counters)
+        observed = np.flatnonzero(self.counters)
+        mean = np.sum(self.sums, axis=0) / n
+        signal = np.dot(self.counters[observed], np.square(self.sums[observed] / self.counters[observed, None] - mean)) / n
+        noise = np.sum(self.sumSquaredDeviations, axis=0) / n
+        return signal, noise
+
+    def snr(self):
+        ''' return the signal-to-noise ratio trace Var(E[T|X]) / E[Var(T|X)]'''
+        signal, noise = self.getSignalAndNoise()
+        return signal / noise
+
+    def nicv(self):
+        ''' return the normalized inter-class variance trace Var(E[T|X]) / Var(T)'''
+        signal, noise = self.getSignalAndNoise()
+        return signal / (signal + noise)
+
+
+class ConditionalAveragerAesAllBytes:
+    '''Conditional averaging of several bytes of the AES state (all 16 by
+       default) at once, so that one read of every batch of traces updates
+       the averages of all the bytes. The averages are kept in a
+       (b,256,t) array; to save memory, they can be kept in float32 and/or
+       for a window of samples only, and the per-value deviations (for snr
+       and nicv) can be dropped. Unlike in the single-byte averager, running
+       averages are kept rather than sums, for the precision in float32.'''
+
+    def __init__(self, traceLength, byteNumbers=range(16), sampleRange=None, dtype='float64', keepDeviations=True):
+        '''Allocate the averages for the bytes of the data with the given
+           numbers; sampleRange (low, high) restricts the averages to these
+           samples of the traces of traceLength samples'''
+        self.byteNumbers = list(byteNumbers)
+        self.sampleRange = sampleRange
+        if sampleRange is not None:
+            traceLength = sampleRange[1] - sampleRange[0]
+        numBytes = len(self.byteNumbers)
+        self.avtraces = np.zeros((numBytes, 256, traceLength), dtype=dtype)
+        self.counters = np.zeros((numBytes, 256))
+        self.sumSquares = np.zeros(traceLength) # sum of squared traces, the same for all the bytes
+        self.sumSquaredDeviations = None
+        if keepDeviations:
+            self.sumSquaredDeviations = np.zeros((numBytes, 256, traceLength), dtype=dtype)
+        print 'ConditionalAverager: initialized for %d bytes and trace length %d, %d MB' % (numBytes, traceLength, (self.avtraces.nbytes * (2 if keepDeviations else 1)) >> 20)
+
+    def addTraces(self, data, traces):
+        '''Add a batch of traces with the corresponding (n,16) data'''
+        if self.sampleRange is not None:
+            traces = traces[:, self.sampleRange[0]:self.sampleRange[1]]
+        for i in range(len(self.byteNumbers)):
+            values = data[:, self.byteNumbers[i]]
+            if self.sumSquaredDeviations is None:
+                (counts, sums) = conditionalSums(values, traces, 256)
+                sumSquaredDeviations = None
+            else:
+                (counts, sums, sumSquaredDeviations) = conditionalMoments(values, traces, 256)
+            self.mergeMoments(i, counts, sums, sumSquaredDeviations)
+        if self.sumSquaredDeviations is None:
+            self.sumSquares += np.einsum('nt,nt->t', traces, traces, dtype='float64', optimize='optimal')
+        else:
+            # from the moments of the last byte, same traces for all the bytes
+            observed = np.flatnonzero(counts)
+            self.sumSquares += np.sum(sumSquaredDeviations, axis=0) + np.dot(1 / counts[observed], np.square(sums[observed]))
+
+    def mergeMoments(self, byteIndex, counts, sums, sumSquaredDeviations=None):
+        '''Merge per-value moments of a batch of traces into the running
+           averages of the byte with the given index in byteNumbers, see
+           ConditionalAveragerAesSbox.mergeMoments'''
+        observed = np.flatnonzero(counts)
+        na = self.counters[byteIndex, observed]
+        nb = counts[observed]
+        n = na + nb
+        delta = sums[observed] / nb[:, None] - self.avtraces[byteIndex, observed]
+        self.avtraces[byteIndex, observed] += delta * (nb / n)[:, None]
+        if sumSquaredDeviations is None:
+            self.sumSquaredDeviations = None # not known for the merged traces any more
+        if self.sumSquaredDeviations is not None:
+            self.sumSquaredDeviations[byteIndex, observed] += sumSquaredDeviations[observed] + np.square(delta) * (na * nb / n)[:, None]
+        self.counters[byteIndex, observed] = n
+
+    def merge(self, other):
+        '''Merge the averager of another set of traces, with the same bytes
+           and samples, into this one'''
+        for i in range(len(self.byteNumbers)):
+            sums = other.avtraces[i] * other.counters[i][:, None]
+            sumSquaredDeviations = None if other.sumSquaredDeviations is None else other.sumSquaredDeviations[i]
+            self.mergeMoments(i, other.counters[i], sums, sumSquaredDeviations)
+        self.sumSquares += other.sumSquares
+
+    def getSnapshot(self, byteIndex):
+        ''' return a snapshot of the average matrix of the byte with the given
+            index in byteNumbers'''
+        avdataSnap = np.flatnonzero(self.counters[byteIndex])
+        avtracesSnap = self.avtraces[byteIndex, avdataSnap]
         return avdataSnap, avtracesSnap
+
+    def getWeightedSnapshot(self, byteIndex):
+        ''' return a snapshot of the byte with the given index together with
+            the counts and the sum of squared traces, for exact weighted CPA/LRA'''
+        avdataSnap, avtracesSnap = self.getSnapshot(byteIndex)
+        return avdataSnap, avtracesSnap, self.counters[byteIndex, avdataSnap], self.sumSquares.copy()
+
+    def getSignalAndNoise(self, byteIndex):
+        ''' return the signal and noise traces of the byte with the given index,
+            see ConditionalAveragerAesSbox.getSignalAndNoise (requires keepDeviations)'''
+        counters = self.counters[byteIndex]
+        n = np.sum(counters)
+        mean = np.dot(counters, self.avtraces[byteIndex]) / n
+        signal = np.dot(counters, np.square(self.avtraces[byteIndex] - mean)) / n
+        noise = np.sum(self.sumSquaredDeviations[byteIndex], axis=0, dtype='float64') / n
+        return signal, noise
+
+    def snr(self, byteIndex):
+        ''' return the signal-to-noise ratio trace of the byte with the given index'''
+        signal, noise = self.getSignalAndNoise(byteIndex)
+        return signal / noise
+
+    def nicv(self, byteIndex):
+        ''' return the normalized inter-class variance trace of the byte with the given index'''
+        signal, noise = self.getSignalAndNoise(byteIndex)
+        return signal / (signal + noise)
+
+
+# Conditional averaging of a whole array of traces at once by the data byte
+# data   - 1-D array of n data bytes (e.g. plaintext bytes of one S-box)
+# traces - (n,t) array of traces
+# returns observed data values and (v,t) array of averaged traces, like
+# getSnapshot of the averager
+def conditionalAveragingAESSbox(data, traces):
+    (counts, sums) = conditionalSums(data, traces, 256)
+    avdata = np.flatnonzero(counts)
+    return avdata, sums[avdata] / counts[avdata, None]
@@ -8,12 +8,17 @@ Conditional averaging for DES
 
 import numpy as np
 
+from lracpa import conditionalSums, conditionalMoments
+from desutils import desInputs
+
 class ConditionalAveragerDes:
 
     def __init__(self, numValues, traceLength):
-        '''Allocate the matrix of averaged traces'''
-        self.avtraces = np.zeros((numValues, traceLength))
+        '''Allocate the sums of traces per value'''
+        self.sums = np.zeros((numValues, traceLength))
         self.counters = np.zeros(numValues)
+        self.sumSquares = np.zeros(traceLength) # sum of squared traces, for weighted CPA/LRA
+        self.sumSquaredDeviations = np.zeros((numValues, traceLength)) # per value, from its average
         print 'ConditionalAverager: initialized for %d values and trace length %d' % (numValues, traceLength)
 
     def addTrace(self, data, trace, dataFunction, sBoxNumber):
@@ -21,14 +26,109 @@ class ConditionalAveragerDes:
 
         x = dataFunction(data, sBoxNumber)
 
-        if (self.counters[x] == 0):
-            self.avtraces[x] = trace
-        else:
-            self.avtraces[x] = self.avtraces[x] + (trace - self.avtraces[x]) / self.counters[x]
+        delta = trace - self.sums[x] / max(self.counters[x], 1)
         self.counters[x] += 1
+        self.sums[x] += trace
+        if self.sumSquaredDeviations is not None:
+            self.sumSquaredDeviations[x] += delta * (trace - self.sums[x] / self.counters[x]) # Welford's update
+        self.sumSquares += np.square(trace, dtype='float64')
+
+    def addTraces(self, data, traces, dataFunction, sBoxNumber):
+        '''Add a batch of traces with the corresponding data (see desInputs in
+           desutils), grouping the traces by the value computed with the given
+           function at once instead of a call of addTrace per trace; the
+           function gets the whole array of inputs, like
+           roundXOR_valueForAveraging'''
+        x = np.asarray(dataFunction(desInputs(data), sBoxNumber), dtype='int64')
+        (counts, sums, sumSquaredDeviations) = conditionalMoments(x, traces, len(self.counters))
+        self.mergeMoments(counts, sums, sumSquaredDeviations)
+        observed = np.flatnonzero(counts)
+        self.sumSquares += np.sum(sumSquaredDeviations, axis=0) + np.dot(1 / counts[observed], np.square(sums[observed]))
+
+    def mergeMoments(self, counts, sums, sumSquaredDeviations):
+        '''Merge per-value counts, sums and sums of squared deviations of a
+           batch of traces (see conditionalMoments in lracpa) into these,
+           with the pairwise update of Chan et al. for the deviations'''
+        observed = np.flatnonzero(counts)
+        na = self.counters[observed]
+        nb = counts[observed]
+        n = na + nb
+        if sumSquaredDeviations is None:
+            self.sumSquaredDeviations = None # not known for the merged traces any more
+        if self.sumSquaredDeviations is not None:
+            delta = sums[observed] / nb[:, None] - self.sums[observed] / np.maximum(na, 1)[:, None]
+            self.sumSquaredDeviations[observed] += sumSquaredDeviations[observed] + np.square(delta) * (na * nb / n)[:, None]
+        self.sums[observed] += sums[observed]
+        self.counters[observed] = n
+
+    def merge(self, other):
+        '''Merge the averager of another set of traces (e.g. another shard of
+           the traceset, averaged in another process) into this one'''
+        self.mergeMoments(other.counters, other.sums, other.sumSquaredDeviations)
+        self.sumSquares += other.sumSquares
+
+    def sliceSamples(self, sampleRange):
+        '''Return a copy of the averager for the samples in sampleRange
+           (low, high) only, e.g. to attack a window of a checkpoint over
+           whole traces (see checkpoints module)'''
+        (low, high) = sampleRange
+        window = ConditionalAveragerDes(len(self.counters), high - low)
+        window.sums = self.sums[:, low:high].copy()
+        window.counters = self.counters.copy()
+        window.sumSquares = self.sumSquares[low:high].copy()
+        if self.sumSquaredDeviations is None:
+            window.sumSquaredDeviations = None
+        else:
+            window.sumSquaredDeviations = self.sumSquaredDeviations[:, low:high].copy()
+        return window
 
     def getSnapshot(self):
         ''' return a snapshot of the average matrix'''
         avdataSnap = np.flatnonzero(self.counters)   # get an vector of only _observed_ values
-        avtracesSnap = self.avtraces[avdataSnap]     # remove lines corresponding to non-observed values
+        avtracesSnap = self.sums[avdataSnap] / self.counters[avdataSnap, None]
         return avdataSnap, avtracesSnap
+
+    def getWeightedSnapshot(self):
+        ''' return a snapshot of the average matrix together with the number of
+            traces behind every average and the sum of squared traces, for exact
+            weighted CPA/LRA (see counts and sumSquares in lracpa)'''
+        avdataSnap, avtracesSnap = self.getSnapshot()
+        return avdataSnap, avtracesSnap, self.counters[avdataSnap], self.sumSquares.copy()
+
+    def getSignalAndNoise(self):
+        ''' return the per-sample variance of the averages (signal) and the
+            average variance within the values (noise), both weighted by
+            the number of traces per value'''
+        n = np.sum(self.counters)
+        observed = np.flatnonzero(self.counters)
+        mean = np.sum(self.sums, axis=0) / n
+        signal = np.dot(self.counters[observed], np.square(self.sums[observed] / self.counters[observed, None] - mean)) / n
+        noise = np.sum(self.sumSquaredDeviations, axis=0) / n
+        return signal, noise
+
+    def snr(self):
+        ''' return the signal-to-noise ratio trace Var(E[T|X]) / E[Var(T|X)]'''
+        signal, noise = self.getSignalAndNoise()
+        return signal / noise
+
+    def nicv(self):
+        ''' return the normalized inter-class variance trace Var(E[T|X]) / Var(T)'''
+        signal, noise = self.getSignalAndNoise()
+        return signal / (signal + noise)
+
+
+# Conditional averaging of a whole array of traces at once by the value
+# computed from the data with the given function, see ConditionalAveragerDes
+# data         - n 64-bit DES inputs or (n,8) array of data bytes, see
+#                desInputs in desutils
+# traces       - (n,t) array of traces
+# dataFunction - function of (inputs, sBoxNumber) returning the array of
+#                averaging values, like roundXOR_valueForAveraging in desutils
+# numValues    - number of possible averaging values
+# returns observed averaging values and (v,t) array of averaged traces, like
+# getSnapshot of the averager
+def conditionalAveragingDES(data, traces, dataFunction, sBoxNumber, numValues=1024):
+    x = np.asarray(dataFunction(desInputs(data), sBoxNumber), dtype='int64')
+    (counts, sums) = conditionalSums(x, traces, numValues)
+    avdata = np.flatnonzero(counts)
+    return avdata, sums[avdata] / counts[avdata, None]
@@ -12,7 +12,7 @@ mpl.use('TkAgg') # enforcing the backend, otherwise fails on Mac OS X with its d
 import matplotlib.pyplot as plt
 import matplotlib.patches as pch
 
-from lracpa import correlationTraces # my LRA-CPA toolbox
+from lracpa import CpaAccumulator # my LRA-CPA toolbox
 
 ##############################################################################
 # Parameters
@@ -98,11 +98,15 @@ ax2.add_artist(hp)
 
 # main loop; attack and graphics are inevitably interleaved
 corrTraces = np.empty([256, traceLength]);
+cpaAcc = CpaAccumulator(256, traceLength) # online CPA, only the new traces are added every step
+nPrev = 0
 guessedKeyBytePrev = 0
 for n in range(startTraces, stopTraces, stepTraces):
 
     # compute correlation traces, update them in the plot
-    corrTraces = correlationTraces(traces[0:n], HL[0:n])
+    cpaAcc.addTraces(HL[nPrev:n], traces[nPrev:n])
+    nPrev = n
+    corrTraces = cpaAcc.getCorrelation()
     for i in range(0, 256):
         hc[i].set_ydata(corrTraces[i])
         ax1.draw_artist(hc[i])
@@ -10,12 +10,18 @@ Self-tests included
 Uses minor chunks of code from pyDES-2.0.1 (https://twhiteman.netfirms.com/des.html)
 and DPA contest v1 DES example (https://svn.comelec.enst.fr/dpacontest/code/reference/).
 
+The values for conditional averaging can be computed for numpy arrays of
+inputs at once: the initial permutation is then done with byte-sliced lookup
+tables instead of bit by bit.
+
 TODO: rewrite in Cython or in C using cyclic shifts and other natural bitwise
       operations; look at DES implementation in libtomcrypt as an example.
 '''
 
 from operator import sub
 
+import numpy as np
+
 
 ##############################################################################
 # Core functionality
@@ -32,6 +38,40 @@ def permuteBits(x, permutation, inputLength):
                   ((x >> (inputLength - 1 - permutation[i])) & 1))
     return result
 
+def bytePermutationTables(permutation, inputLength):
+    ''' Lookup tables to permute bits of numpy arrays byte by byte: the
+        permutation of x is the OR of tables[i][byte i of x] over the bytes of
+        x, counting from the most significant one. The output bitlength is at
+        most 64 '''
+    tables = np.zeros((inputLength // 8, 256), dtype='uint64')
+    for i in range(inputLength // 8):
+        for b in range(256):
+            tables[i, b] = permuteBits(b << (inputLength - 8 * (i + 1)), permutation, inputLength)
+    return tables
+
+# Byte-sliced tables of the initial permutation, computed on first use
+InitialPermutationTables = None
+
+def initialPermutationArray(inputs):
+    ''' Initial permutation of a numpy array of 64-bit inputs by table lookups,
+        see bytePermutationTables '''
+    global InitialPermutationTables
+    if InitialPermutationTables is None:
+        InitialPermutationTables = bytePermutationTables(InitialPermutation, 64)
+    inputBytes = np.asarray(inputs, dtype='uint64').astype('>u8').view('uint8').reshape(-1, 8)
+    result = InitialPermutationTables[0][inputBytes[:, 0]]
+    for i in range(1, 8):
+        result |= InitialPermutationTables[i][inputBytes[:, i]]
+    return result
+
+def desInputs(data):
+    ''' 64-bit inputs as a numpy uint64 array from an (n,8) array of data bytes
+        (big-endian, viewed at once instead of unpacking every row), or from
+        a list of integers '''
+    if isinstance(data, np.ndarray) and data.ndim == 2:
+        return np.ascontiguousarray(data[:, 0:8], dtype='uint8').view('>u8').ravel().astype('uint64')
+    return np.asarray(data, dtype='uint64')
+
 # These are bit permutaions to be used with permuteBits above,
 # not lookup tables.
 InitialPermutation = [
@@ -196,10 +236,14 @@ def roundKeyChunk(roundKey, n):
 
 def roundXOR_valueForAveraging(input, sBoxNumber):
     ''' Compute the value for conditional averaging from input, for a given
-        S-box number '''
+        S-box number. The input is an integer, or a numpy array of inputs
+        (see desInputs) for the values of all of them at once '''
 
     # prepare the first round input halves
-    permutedInput = permuteBits(input, InitialPermutation, 64)
+    if isinstance(input, np.ndarray):
+        permutedInput = initialPermutationArray(input)
+    else:
+        permutedInput = permuteBits(int(input), InitialPermutation, 64)
     rightHalf = permutedInput & 0xFFFFFFFF
     leftHalf = permutedInput >> 32
 
@@ -213,6 +257,18 @@ def roundXOR_valueForAveraging(input, sBoxNumber):
 
     return r
 
+def roundXOR_valueForAveragingAllSboxes(inputs):
+    ''' Compute the values for conditional averaging of all 8 S-boxes from a
+        numpy array of n inputs, sharing the initial permutation; returns an
+        (8,n) array '''
+    permutedInput = initialPermutationArray(inputs)
+    rightHalf = (permutedInput & 0xFFFFFFFF).astype('uint32') # halves in 32 bits are faster to work on
+    xorHalves = rightHalf ^ (permutedInput >> 32).astype('uint32')
+    values = np.empty((8, len(permutedInput)), dtype='uint16')
+    for s in range(8):
+        values[s] = (ExpansionPerSbox[s](rightHalf) << 4) | InversePermutationPerSbox[s](xorHalves)
+    return values
+
 def roundXOR_targetVariable(averagingValue, keyChunk, sBoxNumber):
     ''' Compute the intermediate variable the value used for from key chunk,
         for a given S-box number '''
@@ -0,0 +1,87 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Success rate and guessing entropy of CPA and LRA on an AES S-box, over random
+orderings of the traces (see successrate module), with confidence bands
+'''
+
+import numpy as np
+import matplotlib.pyplot as plt
+import time
+
+from lracpa import *      # my LRA-CPA toolbox
+from successrate import * # SR/GE estimation
+
+
+##################################################
+### 0. Configurable parameters
+
+tracesetFilename = "traces/swaes_atmega_power.npz"
+sampleRange      = (950, 1150) # range of samples to attack, in the format (low, high)
+N                = 100 # number of traces per repetition
+evolutionStep    = 5   # step between numbers of traces
+tracesToSkip     = 20  # smallest number of traces
+numRepetitions   = 100 # number of random orderings
+bootstrap        = False # draw the traces with replacement instead of ordering them
+SboxNum          = 2   # S-box to attack, counting from 0
+resultsFile      = None # npz file to save the ranks to, e.g. "results/successRateSbox%02d" % SboxNum
+
+intermediateFunction = sBoxOut
+leakageFunction      = leakageModelHW
+basisFunctionsModel  = basisModelSingleBits
+
+knownKey = np.array([0x2B,0x7E,0x15,0x16,0x28,0xAE,0xD2,0xA6,0xAB,0xF7,0x15,0x88,0x09,0xCF,0x4F,0x3C], dtype="uint8")
+
+
+##################################################
+### 1. Load all the traces to draw from
+
+npzfile = np.load(tracesetFilename)
+data = npzfile['data'][:, SboxNum]
+traces = npzfile['traces'][:, sampleRange[0]:sampleRange[1]]
+print "Traces to draw from     :", traces.shape[0]
+
+
+##################################################
+### 2. Ranks over the repetitions
+
+t0 = time.time()
+traceNumbers = evolutionTraceNumbers(N, evolutionStep, tracesToSkip)
+(ranksCPA, ranksLRA) = resampledRanksAES(data, traces, intermediateFunction, leakageFunction, basisFunctionsModel,
+                                         knownKey[SboxNum], traceNumbers, numRepetitions, bootstrap, seed=0)
+t1 = time.time()
+print "Time for %d repetitions : %0.2f s" % (numRepetitions, t1 - t0)
+
+if resultsFile is not None:
+    np.savez(resultsFile, traceNumbers=traceNumbers, ranksCPA=ranksCPA, ranksLRA=ranksLRA)
+
+print "%6s %22s %22s" % ("traces", "CPA SR / GE", "LRA SR / GE")
+srCPA = successRate(ranksCPA)
+srLRA = successRate(ranksLRA)
+geCPA = guessingEntropy(ranksCPA, numCandidates=256)
+geLRA = guessingEntropy(ranksLRA, numCandidates=256)
+for s in range(len(traceNumbers)):
+    print "%6d %12.2f / %7.2f %12.2f / %7.2f" % (traceNumbers[s], srCPA[0][s], geCPA[0][s], srLRA[0][s], geLRA[0][s])
+
+
+##################################################
+### 3. Plot with the confidence bands
+
+fig, (axSR, axGE) = plt.subplots(2, 1, sharex=True)
+for (name, sr, ge, color) in [("CPA", srCPA, geCPA, 'green'), ("LRA", srLRA, geLRA, 'magenta')]:
+    axSR.plot(traceNumbers, sr[0], color=color, label=name)
+    axSR.fill_between(traceNumbers, sr[1], sr[2], color=color, alpha=0.2)
+    axGE.plot(traceNumbers, ge[0], color=color, label=name)
+    axGE.fill_between(traceNumbers, ge[1], ge[2], color=color, alpha=0.2)
+
+fig.suptitle("S-box %d, %d repetitions" % (SboxNum, numRepetitions))
+axSR.set_ylabel('Success rate')
+axSR.set_ylim([0, 1])
+axGE.set_ylabel('Guessing entropy (average rank)')
+axGE.set_xlabel('Number of traces')
+axSR.legend(loc='lower right')
+axGE.legend(loc='upper right')
+
+plt.show()
@@ -0,0 +1,180 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Full-key rank estimation and key enumeration from the scores of the per-byte
+(AES) or per-S-box (DES) attacks.
+
+The scores of every subkey are first turned into log-probabilities. The rank
+of the full key is then bounded by convolving the histograms of the subkey
+log-probabilities, a la Glowacz et al., FSE'15 [https://eprint.iacr.org/2014/920].
+The enumerator yields the full keys in the exact order of decreasing
+probability, merging the sorted subkey lists pairwise in a tree of lazy
+frontier enumerators a la Veyrat-Charvillon et al., SAC'12
+[https://eprint.iacr.org/2012/405].
+'''
+
+import heapq
+import numpy as np
+
+
+#############################################################################
+### Scores to probabilities
+
+# Normalize log-probabilities of the candidates of every subkey to sum up to 1
+# logProbabilities - (b,m) array of unnormalized log-probabilities
+def normalizeLogProbabilities(logProbabilities):
+    logProbabilities = np.asarray(logProbabilities, dtype='float64')
+    peak = np.max(logProbabilities, axis=1)[:, None]
+    return logProbabilities - peak - np.log(np.sum(np.exp(logProbabilities - peak), axis=1))[:, None]
+
+# Log-probabilities from correlation peaks. With the Fisher transform z of the
+# correlation, z is approximately normal with variance 1/(n-3), so the
+# likelihood of a candidate being the correct one (against it being wrong,
+# i.e. z around 0) is exp((n-3) z^2 / 2).
+# peaks     - (b,m) array of absolute correlation peaks of m candidates for b subkeys
+#             (like np.max(np.abs(CorrTraces), axis=-1))
+# numTraces - number of traces of the attack
+# returns (b,m) array of normalized log-probabilities
+def correlationLogProbabilities(peaks, numTraces):
+    z = np.arctanh(np.minimum(np.abs(peaks), 1 - 1e-15))
+    return normalizeLogProbabilities((numTraces - 3) * z ** 2 / 2)
+
+# Log-probabilities from R2 peaks of LRA, treating the square root of R2 (the
+# multiple correlation) as the correlation above
+def r2LogProbabilities(R2Peaks, numTraces):
+    return correlationLogProbabilities(np.sqrt(np.maximum(R2Peaks, 0)), numTraces)
+
+
+#############################################################################
+### Rank estimation
+
+# Bounds on the rank of the full key by histogram convolution. The rank is 1
+# for the most probable key. The log-probability of a subkey is rounded down
+# to one of numBins bins, so the sum over b subkeys is off by less than b bins;
+# the keys more than b bins above (below) the correct one are surely more
+# (less) probable.
+# logProbabilities - (b,m) log-probabilities of the m candidates of b subkeys
+# correctKey       - (b,) correct subkey values
+# numBins          - number of bins per subkey, the bounds get tighter and the
+#                    convolution slower with more bins
+# extraBits        - number of key bits not covered by the subkeys and to be
+#                    brute-forced, e.g. 8 for the 56-bit DES key from 8 S-boxes
+# returns lower bound, estimate and upper bound of the rank (as floats, since
+# they do not fit into integers for a full AES key)
+def keyRankBounds(logProbabilities, correctKey, numBins=512, extraBits=0):
+
+    logProbabilities = np.asarray(logProbabilities, dtype='float64')
+    numSubkeys = logProbabilities.shape[0]
+
+    # bin the log-probabilities, impossible candidates go to the lowest bin
+    finite = logProbabilities[np.isfinite(logProbabilities)]
+    low = np.min(finite)
+    width = max(np.max(finite) - low, 1e-300) / numBins
+    bins = np.floor((np.maximum(logProbabilities, low) - low) / width).astype('int64')
+    bins = np.minimum(bins, numBins - 1)
+
+    # convolve the histograms of the subkeys
+    histogram = np.ones(1)
+    for i in range(numSubkeys):
+        histogram = np.convolve(histogram, np.bincount(bins[i], minlength=numBins).astype('float64'))
+
+    correctBin = np.sum(bins[np.arange(numSubkeys), correctKey])
+    scale = 2.0 ** extraBits
+    lower = 1 + np.sum(histogram[correctBin + numSubkeys:]) * scale
+    estimate = max(np.sum(histogram[correctBin:]) * scale, 1)
+    upper = np.sum(histogram[max(correctBin - numSubkeys + 1, 0):]) * scale
+    return lower, estimate, upper
+
+
+#############################################################################
+### Key enumeration
+
+class EnumerationList:
+    '''Candidates of a subkey sorted by decreasing log-probability'''
+
+    def __init__(self, logProbabilities):
+        order = np.argsort(-logProbabilities, kind='mergesort')
+        self.items = [(logProbabilities[k], (int(k),)) for k in order]
+
+    def get(self, i):
+        '''Return the i-th best (logProbability, key tuple), or None'''
+        if i < len(self.items):
+            return self.items[i]
+        return None
+
+class EnumerationNode:
+    '''Lazy merge of two enumeration lists (or nodes) into the list of their
+       combinations by decreasing sum of log-probabilities. The frontier of
+       index pairs is kept in a heap; pair (i,j) is pushed from (i-1,j), or
+       from (i,j-1) for i = 0 only, so that every pair is reached once.'''
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.items = []
+        self.heap = []
+        self.push(0, 0)
+
+    def push(self, i, j):
+        a = self.left.get(i)
+        b = self.right.get(j)
+        if a is not None and b is not None:
+            heapq.heappush(self.heap, (-(a[0] + b[0]), i, j))
+
+    def pop(self):
+        '''Return the next best (logProbability, key tuple) without keeping it,
+           or None when exhausted'''
+        if not self.heap:
+            return None
+        (negLogProbability, l, r) = heapq.heappop(self.heap)
+        self.push(l + 1, r)
+        if l == 0:
+            self.push(0, r + 1)
+        return (-negLogProbability, self.left.get(l)[1] + self.right.get(r)[1])
+
+    def get(self, i):
+        '''Return the i-th best (logProbability, key tuple), or None'''
+        while len(self.items) <= i and self.heap:
+            self.items.append(self.pop())
+        if i < len(self.items):
+            return self.items[i]
+        return None
+
+# Enumerate full keys in the order of decreasing probability
+# logProbabilities - (b,m) log-probabilities of the m candidates of b subkeys
+# maxCandidates    - number of keys to enumerate at most
+# The keys are not kept at the root of the tree, only the inner nodes keep the
+# combinations asked for by their parents, which are much fewer than the keys
+# enumerated (about their square root for two halves)
+# yields (logProbability, key) with key a (b,) array of subkey values
+def enumerateKeys(logProbabilities, maxCandidates=None):
+
+    # balanced tree of pairwise merges
+    nodes = [EnumerationList(np.asarray(l, dtype='float64')) for l in logProbabilities]
+    while len(nodes) > 1:
+        nodes = [EnumerationNode(nodes[i], nodes[i + 1]) if i + 1 < len(nodes) else nodes[i]
+                 for i in range(0, len(nodes), 2)]
+    root = nodes[0]
+
+    i = 0
+    while maxCandidates is None or i < maxCandidates:
+        if isinstance(root, EnumerationNode):
+            item = root.pop()
+        else:
+            item = root.get(i)
+        if item is None:
+            return
+        yield item[0], np.array(item[1])
+        i += 1
+
+# Rank of the full key by enumeration, for keys of small rank where the
+# bounds above are not tight enough
+# returns the rank, or None if the key is not among the first maxCandidates
+def keyRankEnumeration(logProbabilities, correctKey, maxCandidates=2**20):
+    correctKey = tuple(int(k) for k in correctKey)
+    for (i, (logProbability, key)) in enumerate(enumerateKeys(logProbabilities, maxCandidates)):
+        if tuple(key) == correctKey:
+            return i + 1
+    return None
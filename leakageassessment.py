@@ -0,0 +1,57 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Leakage assessment by specific-value Welch t-test of the first and second
+order on the AES traceset, in one streaming pass (see ttest module).
+The example traceset has random inputs only; for a fixed-vs-random test on a
+traceset recorded for it, use fixedVsRandom(fixedInput) as group function.
+'''
+
+import numpy as np
+import matplotlib.pyplot as plt
+import time
+
+from lracpa import *   # my LRA-CPA toolbox
+from ttest import *    # Welch t-test
+
+##################################################
+### 0. Configurable parameters
+
+tracesetFilename = "traces/swaes_atmega_power.npz" # or a list of npz files, or a Trace.TraceSet
+sampleRange      = None  # range of samples (low, high), None for all
+chunkSize        = 1000  # number of traces processed at once
+maxOrder         = 2     # highest order of the test
+SboxNum          = 0     # byte to test
+knownKeyByte     = 0x2B  # its key byte
+bitMask          = 0x01  # S-box output bit tested: value 0 against value 1
+
+##################################################
+### 1. One pass over the traceset
+
+t0 = time.time()
+groupFunction = specificValue(sBoxOut, SboxNum, knownKeyByte, 0, bitMask)
+(tValues, accumulator) = welchTTest(tracesetFilename, groupFunction, maxOrder, chunkSize, sampleRange)
+t1 = time.time()
+
+print "Traces in groups        : %d / %d" % (accumulator.groups[0].n, accumulator.groups[1].n)
+print "Time                    : %0.2f s" % (t1 - t0)
+for order in range(1, maxOrder + 1):
+    leaking = np.flatnonzero(np.abs(tValues[order - 1]) > tvlaThreshold)
+    print "Order %d: max |t| %0.1f, %d samples above %0.1f" % (order, np.max(np.abs(tValues[order - 1])), len(leaking), tvlaThreshold)
+
+##################################################
+### 2. Plot
+
+fig, axes = plt.subplots(maxOrder, 1, sharex=True, squeeze=False)
+for order in range(1, maxOrder + 1):
+    ax = axes[order - 1, 0]
+    ax.plot(tValues[order - 1], color='blue')
+    ax.axhline(tvlaThreshold, color='r')
+    ax.axhline(-tvlaThreshold, color='r')
+    ax.set_ylabel('t, order %d' % order)
+axes[-1, 0].set_xlabel('Time sample')
+fig.suptitle("Specific-value t-test, S-box %d output mask 0x%02x" % (SboxNum, bitMask))
+
+plt.show()
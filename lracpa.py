@@ -11,8 +11,8 @@ AES S-box output and DES per-S-box round XOR are supported as target variables.
 Leakage functions for CPA and basis function models for LRA are defiend here as well.
 
 Non-profiled LRA is implemented a la ASIACRYPT'13 paper [https://eprint.iacr.org/2013/794].
-Implementation uses manual OLS (dot-products and matrix inversion, relying on numpy-MKL
-efficient implementation).
+Implementation uses manual OLS (dot-products and batched solving over all key candidates,
+relying on numpy-MKL efficient implementation).
 '''
 
 import numpy as np
@@ -41,6 +41,99 @@ def invSboxInXorOut(data, keyByte):
     sBoxIn = data ^ keyByte
     return sBoxIn ^ invsbox[sBoxIn]
 
+# Tables of predictions, compiled once per intermediate function (and leakage
+# function) and then reused by the attacks; the tables are read-only
+intermediateTables = {}
+hypothesisTables   = {}
+
+# Predictions of an AES intermediate function for every possible input byte
+# and every key candidate
+# returns (256,256) array, row k holding predictions for key candidate k
+def intermediateValuesAES(intermediateFunction):
+    if intermediateFunction not in intermediateTables:
+        x = np.arange(0, 256, dtype='uint8')
+        k = np.arange(0, 256, dtype='uint8')
+        H = np.zeros((256, 256), dtype='uint8')
+        for i in range(256):
+            H[i,:] = intermediateFunction(x, k[i])
+        H.flags.writeable = False
+        intermediateTables[intermediateFunction] = H
+    return intermediateTables[intermediateFunction]
+
+# Predictions of a DES intermediate function (like roundXOR_targetVariable)
+# for every possible averaging value and every key candidate
+# returns (64,numValues) array, row k holding predictions for key candidate k
+def intermediateValuesDES(intermediateFunction, sBoxNumber, numValues=1024):
+    key = (intermediateFunction, sBoxNumber, numValues)
+    if key not in intermediateTables:
+        H = np.zeros((64, numValues), dtype='uint8')
+        for i in range(64):
+            for j in range(numValues):
+                H[i,j] = intermediateFunction(j, i, sBoxNumber)
+        H.flags.writeable = False
+        intermediateTables[key] = H
+    return intermediateTables[key]
+
+# Leakage hypotheses of an AES intermediate function under a leakage function
+# for every possible input byte and every key candidate, so that the
+# hypotheses for a data vector are the gather hypothesisTableAES(...)[data]
+# returns (256,256) array, row x holding hypotheses for input byte x, in the
+# type returned by leakageFunction (integer for leakageModelHW)
+def hypothesisTableAES(intermediateFunction, leakageFunction):
+    key = (intermediateFunction, leakageFunction)
+    if key not in hypothesisTables:
+        HL = np.ascontiguousarray(np.asarray(leakageFunction(intermediateValuesAES(intermediateFunction))).T)
+        HL.flags.writeable = False
+        hypothesisTables[key] = HL
+    return hypothesisTables[key]
+
+# Number of traces and sum of traces for every data value, computed by
+# grouping the traces with equal values (sort and reduce) instead of
+# a per-trace loop
+# values    - 1-D array of n data values in range(numValues)
+# traces    - (n,t) array of traces
+# numValues - number of possible data values
+# returns (numValues,) array of counts and (numValues,t) array of sums
+def conditionalSums(values, traces, numValues):
+    values = np.asarray(values)
+    counts = np.zeros(numValues)
+    sums = np.zeros((numValues, traces.shape[1]))
+    if len(values) == 0:
+        return counts, sums
+    order = np.argsort(values, kind='mergesort')
+    sortedValues = values[order]
+    starts = np.flatnonzero(np.concatenate(([True], sortedValues[1:] != sortedValues[:-1])))
+    observed = sortedValues[starts]
+    counts[observed] = np.diff(np.append(starts, len(values)))
+    sums[observed] = np.add.reduceat(traces[order], starts, axis=0, dtype='float64')
+    return counts, sums
+
+# Same as conditionalSums, plus the sum of squared deviations of the traces
+# from the average for their value (for merging into running averages with
+# the pairwise update of Chan et al., see the conditional averagers)
+# returns (numValues,) array of counts, (numValues,t) arrays of sums and of
+# sums of squared deviations
+def conditionalMoments(values, traces, numValues):
+    values = np.asarray(values)
+    counts = np.zeros(numValues)
+    sums = np.zeros((numValues, traces.shape[1]))
+    sumSquaredDeviations = np.zeros((numValues, traces.shape[1]))
+    if len(values) == 0:
+        return counts, sums, sumSquaredDeviations
+    order = np.argsort(values, kind='mergesort')
+    sortedValues = values[order]
+    starts = np.flatnonzero(np.concatenate(([True], sortedValues[1:] != sortedValues[:-1])))
+    observed = sortedValues[starts]
+    groupCounts = np.diff(np.append(starts, len(values)))
+    deviations = traces[order].astype('float64')
+    groupSums = np.add.reduceat(deviations, starts, axis=0)
+    deviations -= np.repeat(groupSums / groupCounts[:, None], groupCounts, axis=0)
+    np.square(deviations, out=deviations)
+    counts[observed] = groupCounts
+    sums[observed] = groupSums
+    sumSquaredDeviations[observed] = np.add.reduceat(deviations, starts, axis=0)
+    return counts, sums, sumSquaredDeviations
+
 ##############################################################################
 ### A. LRA attack stuff
 
@@ -51,11 +144,9 @@ def invSboxInXorOut(data, keyByte):
 # 2. compute and return the values of gi(x), such that they can be used
 #    later to obtain rows of the matrix for linear regression
 # Note that column of ones is included!
-# Note also that not all the functions are currently compatible with the code
-#  in the CPA and LRA functions because latter use wrapper functions for
-#  incremental binding. Only those are compatible that take a second bitWidth
-#  argument.
-# TODO: make all functions compatible with incremental binding.
+# All the functions take the bitWidth of x as the second argument, so that
+#  they can be tabulated over all the 2^bitWidth values of x, see
+#  basisModelTable below.
 
 
 # A simple linear model - sum of bits with different coefficients:
@@ -84,7 +175,7 @@ def basisModelSingleBitsAndPairs(x, bitWidth):
     return g
 
 # A Hamming weight model: g0 = HW(x)
-def basisModelHW(x):
+def basisModelHW(x, bitWidth=8):
     g = []
     hw = byteHammingWeight[x]  # this is the definition: gi = HW(x)
     g.append(hw)
@@ -101,152 +192,311 @@ def parityOf(int_type):
     if (parity != 0): # to convert -1 to 1
         parity = 1
     return(parity)
-# b) the model itself
-def basisModel256(x):
+# b) the model itself, for all 2^bitWidth bit combinations
+def basisModel256(x, bitWidth=8):
     g = []
     # note that we start from 1 to exclude case 0 which means the function
     # does not depend on any bit of x, i.e. a constant - we will add the
     # constant explicitly later as the last column.
-    for i in np.arange(1, 256, dtype='uint8'):
+    for i in range(1, 2 ** bitWidth):
         xmasked = x & i
-        gi = parityOf(xmasked)
+        gi = byteHammingWeight[xmasked] & 1 # same as parityOf(xmasked)
         g.append(gi)
     g.append(1)
     return g
 
-# LRA attack on AES
-# data                 - 1-D array of input bytes
-# traces               - 2-D array of traces
-# intermediateFunction - one of the functions like sBoxOut above in the common section 
-# basisFunctionsModel  - one of the functions like basisModelSingleBits above
-#                        in this section
-# TODO parametrize hard-coded values such as 256, 8
-def lraAES(data, traces, intermediateFunction, basisFunctionsModel):
+# Precomputed basis function tables, cached per (basisFunctionsModel, bitWidth)
+basisModelTables = {}
+
+# Tabulate a basis functions model over all the values of the intermediate
+# variable, so that it is evaluated only once per (model, bitWidth) pair.
+# basisFunctionsModel - one of the functions like basisModelSingleBits above
+# bitWidth            - bit width of the intermediate variable
+# returns a read-only (2^bitWidth,p) array, row x holding the values gi(x)
+def basisModelTable(basisFunctionsModel, bitWidth):
+    key = (basisFunctionsModel, bitWidth)
+    if key not in basisModelTables:
+        table = np.array([basisFunctionsModel(x, bitWidth) for x in range(2 ** bitWidth)], dtype='float64')
+        table.flags.writeable = False
+        basisModelTables[key] = table
+    return basisModelTables[key]
+
+# Evaluate the basis functions of a model for an array of intermediate values
+# by a lookup into the precomputed table
+# intermediateVariables - array of intermediate values of any shape
+# basisFunctionsModel   - one of the functions like basisModelSingleBits above
+# bitWidth              - bit width of the intermediate variable
+# returns an array of the shape of intermediateVariables with an extra last
+#  axis holding the values of the basis functions
+def basisMatrix(intermediateVariables, basisFunctionsModel, bitWidth):
+    return basisModelTable(basisFunctionsModel, bitWidth)[intermediateVariables]
+
+# Solve the regressions for a stack of key candidates at all time samples at once.
+# Instead of looping over candidates and samples, all the systems go through
+# the same batched products and a batched solve.
+# M      - (m,n,p) stack of m design matrices, one row of basis function values
+#          per trace
+# traces - (n,t) float array of traces
+# returns (m,p,t) array of regression coefficients and (m,t) array of
+#  sums of squared residuals
+def lraSolve(M, traces):
+    p = M.shape[2]
+    MtM = np.matmul(M.transpose(0, 2, 1), M)
+    MtT = np.dot(M.transpose(0, 2, 1).reshape(-1, M.shape[1]), traces) # single BLAS product
+    beta = np.linalg.solve(MtM, MtT.reshape(len(M), p, -1)) # coefficients for every sample
+    E = np.matmul(M, beta)                                  # expected (fitted) values for every sample
+    E -= traces
+    SSreg = np.einsum('knt,knt->kt', E, E, optimize='optimal')
+    return beta, SSreg
+
+# Same as above, but without computing the coefficients and fitted values
+# (i.e. the Q = M P way) when only R2 is needed. Since the column of ones is
+# included in every model, the sum of squares due to regression for centered
+# traces T is (M^T T) . (M^T M)^-1 (M^T T).
+# With counts given, the rows of M stand for counts[i] traces each, and
+# centeredTraces are the per-row sums of the centered traces; this gives the
+# same result as the regression over all the individual traces.
+# M              - (m,n,p) stack of m design matrices
+# centeredTraces - (n,t) array of traces with the mean trace subtracted
+# counts         - optional (n,) array of the number of traces per row
+# returns (m,t) array of sums of squares due to regression
+def lraSolveR2(M, centeredTraces, counts=None):
+    p = M.shape[2]
+    if counts is None:
+        MtM = np.matmul(M.transpose(0, 2, 1), M)
+    else:
+        MtM = np.matmul(M.transpose(0, 2, 1), M * counts[None, :, None])
+    MtT = np.dot(M.transpose(0, 2, 1).reshape(-1, M.shape[1]), centeredTraces).reshape(len(M), p, -1)
+    X = np.linalg.solve(MtM, MtT)
+    return np.einsum('kpt,kpt->kt', MtT, X, optimize='optimal')
+
+# LRA for all key candidates given their intermediate variable predictions.
+# The candidates are processed in blocks such that the temporary arrays of a
+# block take about memoryLimit bytes.
+# intermediateVariables - (m,n) array of predictions for each of the m candidates
+# traces                - (n,t) array of traces
+# basisFunctionsModel   - one of the functions like basisModelSingleBits above
+# bitWidth              - bit width of the intermediate variable
+# memoryLimit           - memory cap for a block of candidates, in bytes
+# computeCoefs          - if False, skip the coefficients and only compute R2
+# counts, sumSquares    - optional, for conditionally averaged traces, see lraAES
+# returns (m,t) array of R2 and (m,t,p) array of coefficients (None if not computed)
+def lraCandidates(intermediateVariables, traces, basisFunctionsModel, bitWidth, memoryLimit, computeCoefs=True,
+                  counts=None, sumSquares=None):
+
+    # averaged traces weighted by the number of traces behind each of them
+    if counts is not None:
+        counts = np.asarray(counts, dtype='float64')
+        sums = traces * counts[:, None]
+        if sumSquares is None: # only the variance between the averaged traces is known
+            sumSquares = np.einsum('nt,nt->t', sums, traces, optimize='optimal')
+        R2 = lraStatistics(counts, sums, sumSquares, intermediateVariables, basisFunctionsModel, bitWidth, memoryLimit)
+        allCoefs = None
+        if computeCoefs:
+            allCoefs = lraStatisticsCoefs(counts, sums, intermediateVariables, basisFunctionsModel, bitWidth)
+        return R2, allCoefs
 
     ### 0. some helper variables
+    traces = np.asarray(traces, dtype='float64')
     (numTraces, traceLength) = traces.shape
-    
-    # define a wrapper for currying (incremental parameter binding)
-    def basisFunctionsModelWrapper(y):
-        def basisFunctionsModelCurry(x):
-            return basisFunctionsModel(x, y)
-        return basisFunctionsModelCurry
+    numCandidates = len(intermediateVariables)
+    p = basisModelTable(basisFunctionsModel, bitWidth).shape[1]
+
+    # number of candidates per block: design matrices, and either coefficients
+    # and fitted values, or the two (p,t) temporaries of the R2-only path
+    if computeCoefs:
+        candidateBytes = 8 * (numTraces * p + p * traceLength + numTraces * traceLength)
+    else:
+        candidateBytes = 8 * (numTraces * p + 2 * p * traceLength)
+    blockSize = int(min(max(memoryLimit // candidateBytes, 1), numCandidates))
 
     ### 1: compute SST over the traces
-    SStot = np.sum((traces - np.mean(traces, 0)) ** 2, 0)
+    centeredTraces = traces - np.mean(traces, 0)
+    SStot = np.einsum('nt,nt->t', centeredTraces, centeredTraces, optimize='optimal')
 
     ### 2. The main attack loop
 
     # preallocate arrays
-    SSreg = np.empty((256, traceLength)) # Sum of Squares due to regression
-    E = np.empty(numTraces)              # expected values
-
-    allCoefs = [] # placeholder for regression coefficients
-
-    # per-keycandidate loop
-    for k in np.arange(0, 256, dtype='uint8'):
-
-        # predict intermediate variable
-        intermediateVariable = intermediateFunction(data, k)
-
-        # buld equation system
-        M = np.array(map(basisFunctionsModelWrapper(8), intermediateVariable))
-
-        # some precomputations before the per-sample loop
-        P = np.dot(np.linalg.inv(np.dot(M.T, M)), M.T)
-        #Q = np.dot(M, P)
-
-        coefs = [] # placeholder for regression coefficients
+    SSreg = np.empty((numCandidates, traceLength)) # Sum of Squares due to regression (or residual)
 
-        # per-sample loop: solve the system for each time moment
-        for u in range(0,traceLength):
+    allCoefs = None # placeholder for regression coefficients
+    if computeCoefs:
+        allCoefs = np.empty((numCandidates, traceLength, p)) # coefs[k][u] are the coefficients for sample u
 
-            # if do not need coefficients beta - use precomputed value
-            #np.dot(Q, traces[:,u], out=E)
+    # per-block loop
+    for k in range(0, numCandidates, blockSize):
 
-            # if need the coefficients - do the multiplication using
-            # two dot products and let the functuion return beta alongside R2
-            beta = np.dot(P, traces[:,u])
-            coefs.append(beta)
-            E = np.dot(M, beta)
+        # buld equation systems for the block
+        M = basisMatrix(intermediateVariables[k:k + blockSize], basisFunctionsModel, bitWidth)
 
-            SSreg[k,u] = np.sum((E - traces[:,u]) ** 2)
-
-        allCoefs.append(coefs)
-        #print 'Done with candidate', k
+        # solve the systems for all candidates of the block and all time moments at once
+        if computeCoefs:
+            (beta, SSreg[k:k + blockSize]) = lraSolve(M, traces)
+            allCoefs[k:k + blockSize] = beta.transpose(0, 2, 1)
+        else:
+            SSreg[k:k + blockSize] = lraSolveR2(M, centeredTraces)
 
     ### 3. compute Rsquared
-    R2 = 1 - SSreg / SStot[None, :]
+    if computeCoefs:
+        R2 = 1 - SSreg / SStot[None, :]
+    else:
+        R2 = SSreg / SStot[None, :]
 
     return R2, allCoefs
 
+# LRA attack on AES
+# data                 - 1-D array of input bytes
+# traces               - 2-D array of traces
+# intermediateFunction - one of the functions like sBoxOut above in the common section 
+# basisFunctionsModel  - one of the functions like basisModelSingleBits above
+#                        in this section
+# memoryLimit          - memory cap in bytes for a block of candidates solved at once
+# computeCoefs         - if False, return None instead of the coefficients and
+#                        take the faster R2-only path
+# counts               - optional number of traces behind each row of traces, when
+#                        these are conditionally averaged (see getWeightedSnapshot
+#                        in condaveraes); the regression is then weighted to give
+#                        the same result as on the non-averaged traces
+# sumSquares           - optional sum of squares of the non-averaged traces, needed
+#                        with counts to reproduce their R2 exactly
+def lraAES(data, traces, intermediateFunction, basisFunctionsModel, memoryLimit=2**28, computeCoefs=True,
+           counts=None, sumSquares=None):
+
+    # predict intermediate variable for all key candidates
+    H = intermediateValuesAES(intermediateFunction)[:, data]
+
+    return lraCandidates(H, traces, basisFunctionsModel, 8, memoryLimit, computeCoefs, counts, sumSquares)
+
+# LRA attack on several bytes of the AES state at once, e.g. all 16 for a full key.
+# The candidates of all the bytes are stacked, so that SStot and the centered
+# traces are computed once and the blocks of candidates span over bytes.
+# data                 - (n,b) array of input bytes, b bytes per trace
+# traces               - 2-D array of traces
+# intermediateFunction - one of the functions like sBoxOut above in the common section 
+# basisFunctionsModel  - one of the functions like basisModelSingleBits above
+# memoryLimit          - memory cap in bytes for a block of candidates solved at once
+# computeCoefs         - if True, also return the (b,256,t,p) coefficients (these
+#                        take a lot of memory for 16 bytes, so not by default)
+# returns (b,256,t) array of R2 and the coefficients (None if not computed)
+def lraAESMultiByte(data, traces, intermediateFunction, basisFunctionsModel, memoryLimit=2**28, computeCoefs=False):
+
+    numBytes = data.shape[1]
+
+    # predict intermediate variable for all key candidates of all the bytes
+    table = intermediateValuesAES(intermediateFunction)
+    H = np.concatenate([table[:, data[:, j]] for j in range(numBytes)])
+
+    (R2, allCoefs) = lraCandidates(H, traces, basisFunctionsModel, 8, memoryLimit, computeCoefs)
+    R2 = R2.reshape(numBytes, 256, -1)
+    if computeCoefs:
+        allCoefs = allCoefs.reshape((numBytes, 256) + allCoefs.shape[1:])
+    return R2, allCoefs
+
 # LRA attack on DES
 # data                 - array of inputs (format depends on intermediateFunction)
 # traces               - 2-D array of traces
 # intermediateFunction - one of functions like sBoxOut above in the common section
 # sBoxNumber           - DES S-box to attack
 # basisFunctionsModel  - one of function like basisModel9 above in this section
-# TODO parametrize hard-coded values such as 64, 6, refactor to merge common part with AES
-def lraDES(data, traces, intermediateFunction, sBoxNumber, basisFunctionsModel):
-
-    ### 0. some helper variables
-    (numTraces, traceLength) = traces.shape
-
-    # define a wrapper (currying) for incremental parameter binding
-    def basisFunctionsModelWrapper(y):
-        def basisFunctionsModelCurry(x):
-            return basisFunctionsModel(x, y)
-        return basisFunctionsModelCurry
-
-    ### 1: compute SST over the traces
-    SStot = np.sum((traces - np.mean(traces, 0)) ** 2, 0)
-
-    ### 2. The main attack loop
-
-    # preallocate arrays
-    SSreg = np.empty((64, traceLength)) # Sum of Squares due to regression
-    E = np.empty(numTraces)              # expected values
-
-    allCoefs = [] # placeholder for regression coefficient
-
-    # per-keycandidate loop
-    for k in np.arange(0, 64, dtype='uint8'):
-
-        # predict intermediate variable for the current key candiate value
-        intermediateVariable = np.zeros(len(data), dtype='uint8')
+# memoryLimit          - memory cap in bytes for a block of candidates solved at once
+# computeCoefs         - if False, return None instead of the coefficients and
+#                        take the faster R2-only path
+# counts, sumSquares   - optional, for conditionally averaged traces, see lraAES
+def lraDES(data, traces, intermediateFunction, sBoxNumber, basisFunctionsModel, memoryLimit=2**28, computeCoefs=True,
+           counts=None, sumSquares=None):
+
+    # predict intermediate variable for all key candidates
+    k = np.arange(0, 64, dtype='uint8')
+    H = np.zeros((64, len(data)), dtype='uint8')
+    for i in range(64):
         for j in range(0, len(data)):
-            intermediateVariable[j] = intermediateFunction(data[j], k, sBoxNumber)
-
-        # buld equation system
-        M = np.array(map(basisFunctionsModelWrapper(4), intermediateVariable))
-
-        # some precomputations before the per-sample loop
-        P = np.dot(np.linalg.inv(np.dot(M.T, M)), M.T)
-        #Q = np.dot(M, P)
-
-        coefs = [] # placeholder for regression coefficients
-
-        # per-sample loop: solve the system for each time moment
-        for u in range(0,traceLength):
-
-            # if do not need coefficients beta - use precomputed value
-            #np.dot(Q, traces[:,u], out=E)
-
-            # if need the coefficients - do the multiplication using
-            # two dot products and let the functuion return beta alongside R2
-            beta = np.dot(P, traces[:,u])
-            coefs.append(beta)
-            E = np.dot(M, beta)
+            H[i,j] = intermediateFunction(data[j], k[i], sBoxNumber)
 
-            SSreg[k,u] = np.sum((E - traces[:,u]) ** 2)
+    return lraCandidates(H, traces, basisFunctionsModel, 4, memoryLimit, computeCoefs, counts, sumSquares)
+
+# LRA from sufficient statistics. The rows of the design matrix depend only on
+# the data value, so M^T M and M^T T are built from the number of traces and
+# the sum of traces per data value, and SStot from the sum of squared traces.
+# The result is the exact R2 of the regression over all the individual traces.
+# counts                - (v,) number of traces per data value
+# sums                  - (v,t) sum of traces per data value
+# sumSquares            - (t,) sum of squared traces over all the traces
+# intermediateVariables - (m,v) array of predictions of each of the m key
+#                         candidates for each of the v data values
+# basisFunctionsModel   - one of the functions like basisModelSingleBits above
+# bitWidth              - bit width of the intermediate variable
+# memoryLimit           - memory cap in bytes for a block of candidates solved at once
+# returns (m,t) array of R2
+def lraStatistics(counts, sums, sumSquares, intermediateVariables, basisFunctionsModel, bitWidth, memoryLimit=2**28):
 
-        allCoefs.append(coefs)
-        #print 'Done with candidate', k
+    ### 0. some helper variables
+    (numValues, traceLength) = sums.shape
+    numCandidates = len(intermediateVariables)
+    p = basisModelTable(basisFunctionsModel, bitWidth).shape[1]
+    candidateBytes = 8 * (numValues * p + 2 * p * traceLength)
+    blockSize = int(min(max(memoryLimit // candidateBytes, 1), numCandidates))
+
+    # only the observed values contribute
+    observed = np.flatnonzero(counts)
+    counts = counts[observed]
+    sums = sums[observed]
+
+    ### 1: compute SST from the statistics
+    numTraces = np.sum(counts)
+    meanTrace = np.sum(sums, 0) / numTraces
+    SStot = sumSquares - numTraces * meanTrace ** 2
+    centeredSums = sums - counts[:, None] * meanTrace[None, :]
+
+    ### 2. The main loop over blocks of candidates
+    SSreg = np.empty((numCandidates, traceLength)) # Sum of Squares due to regression
+    for k in range(0, numCandidates, blockSize):
+        M = basisMatrix(intermediateVariables[k:k + blockSize, observed], basisFunctionsModel, bitWidth)
+        SSreg[k:k + blockSize] = lraSolveR2(M, centeredSums, counts)
 
     ### 3. compute Rsquared
-    R2 = 1 - SSreg / SStot[None, :]
-
-    return R2, allCoefs
+    return SSreg / SStot[None, :]
+
+# Regression coefficients from sufficient statistics, see lraStatistics above
+# returns (m,t,p) array of coefficients
+def lraStatisticsCoefs(counts, sums, intermediateVariables, basisFunctionsModel, bitWidth):
+    observed = np.flatnonzero(counts)
+    M = basisMatrix(intermediateVariables[:, observed], basisFunctionsModel, bitWidth)
+    MtM = np.matmul(M.transpose(0, 2, 1), M * counts[observed][None, :, None])
+    MtT = np.einsum('kvp,vt->kpt', M, sums[observed], optimize='optimal')
+    return np.linalg.solve(MtM, MtT).transpose(0, 2, 1)
+
+class LraAccumulator:
+    '''Streaming LRA. Ingests batches of traces and keeps only the per-value
+       counts and sums of traces and the sum of squared traces, so the memory
+       and the cost of getR2() do not depend on the number of traces.'''
+
+    def __init__(self, intermediateVariables, traceLength, basisFunctionsModel, bitWidth):
+        '''intermediateVariables is an (m,v) array of predictions per key candidate
+           and data value, e.g. from intermediateValuesAES/intermediateValuesDES'''
+        self.intermediateVariables = intermediateVariables
+        self.basisFunctionsModel = basisFunctionsModel
+        self.bitWidth = bitWidth
+        numValues = intermediateVariables.shape[1]
+        self.counts = np.zeros(numValues)
+        self.sums = np.zeros((numValues, traceLength))
+        self.sumSquares = np.zeros(traceLength)
+
+    def addTraces(self, data, traces):
+        '''Add a batch of traces with the corresponding data values'''
+        (counts, sums) = conditionalSums(data, traces, len(self.counts))
+        self.counts += counts
+        self.sums += sums
+        self.sumSquares += np.einsum('nt,nt->t', traces, traces, dtype='float64', optimize='optimal')
+
+    def getR2(self):
+        '''Return the (m,t) matrix of R2 for all the traces added so far'''
+        return lraStatistics(self.counts, self.sums, self.sumSquares, self.intermediateVariables,
+                             self.basisFunctionsModel, self.bitWidth)
+
+    def getCoefs(self):
+        '''Return the (m,t,p) array of regression coefficients'''
+        return lraStatisticsCoefs(self.counts, self.sums, self.intermediateVariables,
+                                  self.basisFunctionsModel, self.bitWidth)
 
 # convert R2 to adjusted R2 (https://en.wikipedia.org/wiki/Coefficient_of_determination#Adjusted_R2)
 # n - number of samples
@@ -285,8 +535,17 @@ def correlationTraceSO(O, P):
 # Takes the full matrix of predictions instead of just a column
 # O - (n,t) array of n traces with t samples each
 # P - (n,m) array of n predictions for each of the m candidates
+# precision - 'float64' (default), or 'float32' or 'exact' for the
+#             correlationTracesFloat32 and correlationTracesExact paths below
 # returns an (m,t) correaltion matrix of m traces t samples each
-def correlationTraces(O, P):
+def correlationTraces(O, P, precision='float64'):
+    if precision == 'float32':
+        return correlationTracesFloat32(O, P)
+    if precision == 'exact':
+        return correlationTracesExact(O, P)
+    if precision != 'float64':
+        raise ValueError("unknown precision %s" % precision)
+
     (n, t) = O.shape      # n traces of t samples
     (n_bis, m) = P.shape  # n predictions for each of m candidates
 
@@ -301,35 +560,332 @@ def correlationTraces(O, P):
 
     return numerator / denominator
 
+# Correlation traces in single precision. Traces are centered and multiplied
+# in float32 in blocks of blockSize traces, the per-block results are
+# accumulated in float64. Halves the memory traffic w.r.t. float64; on int8
+# AES traces the deviation from correlationTraces is in the order of 1e-7
+# (see compareprecision.py).
+# O, P      - as in correlationTraces
+# blockSize - number of traces converted to float32 at a time
+def correlationTracesFloat32(O, P, blockSize=4096):
+    (n, t) = O.shape      # n traces of t samples
+    (n_bis, m) = P.shape  # n predictions for each of m candidates
+
+    meanO = (np.einsum("nt->t", O, dtype='float64', optimize='optimal') / np.double(n)).astype('float32')
+    DP = (P - (np.einsum("nm->m", P, dtype='float64', optimize='optimal') / np.double(n))).astype('float32')
+
+    numerator = np.zeros((m, t))
+    tmp2 = np.zeros(t)
+    for a in range(0, n, blockSize):
+        DO = O[a:a + blockSize].astype('float32') - meanO
+        numerator += np.dot(DP[a:a + blockSize].T, DO)
+        tmp2 += np.einsum("nt,nt->t", DO, DO, optimize='optimal')
+    tmp1 = np.einsum("nm,nm->m", DP, DP, dtype='float64', optimize='optimal')
+    tmp = np.einsum("m,t->mt", tmp1, tmp2, optimize='optimal')
+    denominator = np.sqrt(tmp)
+
+    return numerator / denominator
+
+# Correlation traces with exact integer accumulation, for integer traces (like
+# int8/int16 samples from trs files) and integer predictions (like Hamming
+# weights). The sums and cross-products are accumulated exactly in int64, block
+# by block in the native sample type. Float32 products are used when the partial
+# sums of a block stay below 2^24 (where float32 is still exact, e.g. for int8
+# samples), float64 ones otherwise. Only the final normalization is done in
+# floating point, so the result matches correlationTraces to rounding of the
+# final division, or better.
+# O, P - as in correlationTraces, both of an integer type
+def correlationTracesExact(O, P):
+    if not (np.issubdtype(O.dtype, np.integer) and np.issubdtype(P.dtype, np.integer)):
+        raise ValueError("exact correlation needs integer traces and predictions, got %s and %s" % (O.dtype, P.dtype))
+
+    (n, t) = O.shape      # n traces of t samples
+    (n_bis, m) = P.shape  # n predictions for each of m candidates
+
+    # largest possible product, to choose the type and the block size such
+    # that the per-block sums are exact
+    maxO = max(-int(np.iinfo(O.dtype).min), int(np.iinfo(O.dtype).max))
+    maxP = max(int(np.max(np.abs(P.astype('int64')))), 1)
+    maxProduct = max(maxO * maxP, maxO * maxO)
+    if 2**24 // maxProduct >= 1024:
+        (blockType, blockSize) = ('float32', 2**24 // maxProduct)
+    else:
+        (blockType, blockSize) = ('float64', 2**53 // maxProduct)
+    blockSize = min(blockSize, 2**16) # bound the memory for converted blocks
+
+    sumO = np.zeros(t, dtype='int64')
+    sumO2 = np.zeros(t, dtype='int64')
+    sumPO = np.zeros((m, t), dtype='int64')
+    for a in range(0, n, blockSize):
+        Ob = O[a:a + blockSize].astype(blockType)
+        Pb = P[a:a + blockSize].astype(blockType)
+        sumO += np.rint(np.einsum("nt->t", Ob, optimize='optimal')).astype('int64')
+        sumO2 += np.rint(np.einsum("nt,nt->t", Ob, Ob, optimize='optimal')).astype('int64')
+        sumPO += np.rint(np.dot(Pb.T, Ob)).astype('int64')
+    sumP = np.sum(P, 0, dtype='int64')
+    sumP2 = np.sum(P.astype('int64') ** 2, 0)
+
+    # n^2 var and n^2 cov, exactly in int64 unless this may overflow
+    if n * n * maxProduct >= 2**62:
+        (sumO, sumO2, sumP, sumP2, sumPO) = [x.astype('float64') for x in (sumO, sumO2, sumP, sumP2, sumPO)]
+    numerator = n * sumPO - np.outer(sumP, sumO)
+    tmp1 = n * sumP2 - sumP ** 2
+    tmp2 = n * sumO2 - sumO ** 2
+    tmp = np.outer(tmp1.astype('float64'), tmp2.astype('float64'))
+    denominator = np.sqrt(tmp)
+
+    return numerator / denominator
+
+# Correlation computed in tiles along the sample axis, with bounded memory.
+# Only one tile of samples is converted to float64 and centered at a time, so
+# this works directly on a memory-mapped (np.memmap, np.load with mmap_mode)
+# traces array that does not fit in RAM.
+# O           - (n,t) array of n traces with t samples each, possibly memory-mapped
+# P           - (n,m) array of n predictions for each of the m candidates
+# memoryLimit - approximate memory budget for the temporaries of a tile, in bytes
+# yields the first sample index of a tile and the (m,tileLength) correlation matrix
+def correlationTiles(O, P, memoryLimit):
+    (n, t) = O.shape      # n traces of t samples
+    (n_bis, m) = P.shape  # n predictions for each of m candidates
+
+    # predictions are small and centered once
+    DP = P - (np.einsum("nm->m", P, dtype='float64', optimize='optimal') / np.double(n)) # compute P - mean(P)
+    tmp1 = np.einsum("nm,nm->m", DP, DP, optimize='optimal')
+
+    # a tile holds the traces in float64 and centered, (n,tileLength) each, and
+    # the numerator, the denominator and the correlation, (m,tileLength) each
+    tileLength = int(min(max(memoryLimit // (8 * (2 * n + 3 * m)), 1), t))
+
+    for u in range(0, t, tileLength):
+        yield u, correlationTile(O[:, u:u + tileLength], DP, tmp1)
+
+# Correlation of one tile of samples, see correlationTiles above; the
+# temporaries of the tile are released on return, before the next tile is read
+# Ot   - (n,tileLength) traces of the tile, possibly memory-mapped
+# DP   - (n,m) centered predictions
+# tmp1 - (m,) sums of squares of DP
+# returns the (m,tileLength) correlation matrix
+def correlationTile(Ot, DP, tmp1):
+    Ot = np.asarray(Ot, dtype='float64')
+    DO = Ot - (np.einsum("nt->t", Ot, optimize='optimal') / np.double(Ot.shape[0])) # compute O - mean(O)
+    numerator = np.dot(DP.T, DO)
+    tmp2 = np.einsum("nt,nt->t", DO, DO, optimize='optimal')
+    return numerator / np.sqrt(np.einsum("m,t->mt", tmp1, tmp2, optimize='optimal'))
+
+# Correlation traces computed tile by tile, see correlationTiles above
+# O, P, memoryLimit - as in correlationTiles
+# out               - optional preallocated (m,t) output array, possibly memory-mapped
+# returns an (m,t) correlation matrix (out, if given)
+def correlationTracesTiled(O, P, memoryLimit=2**28, out=None):
+    if out is None:
+        out = np.empty((P.shape[1], O.shape[1]))
+    for (u, CorrTile) in correlationTiles(O, P, memoryLimit):
+        out[:, u:u + CorrTile.shape[1]] = CorrTile
+    return out
+
+# Correlation peaks without materializing the full correlation matrix: the
+# samples are processed tile by tile (see correlationTiles above), keeping per
+# candidate only the running maximum of the absolute correlation, its sign and
+# its sample index, and optionally the topK largest absolute values.
+# O, P, memoryLimit - as in correlationTiles
+# topK              - if given, also keep the topK sample locations per candidate
+# returns (m,) peaks of |correlation|, (m,) their signs, (m,) their sample indices,
+#  and with topK also (m,topK) sample indices and (m,topK) |correlation| values,
+#  ordered from the largest
+def correlationPeaks(O, P, memoryLimit=2**26, topK=None):
+    m = P.shape[1]
+    peaks = np.full(m, -1.0)
+    signs = np.zeros(m)
+    indices = np.zeros(m, dtype='int64')
+    topIndices = np.zeros((m, 0), dtype='int64')
+    topValues = np.zeros((m, 0))
+    rows = np.arange(m)
+
+    for (u, CorrTile) in correlationTiles(O, P, memoryLimit):
+        AbsTile = np.abs(CorrTile)
+
+        # running maximum
+        tileIndices = np.argmax(AbsTile, axis=1)
+        tilePeaks = AbsTile[rows, tileIndices]
+        better = tilePeaks > peaks
+        peaks[better] = tilePeaks[better]
+        signs[better] = np.sign(CorrTile[rows, tileIndices])[better]
+        indices[better] = u + tileIndices[better]
+
+        # running top-k: merge the tile with the current top and select again
+        if topK:
+            values = np.concatenate((topValues, AbsTile), axis=1)
+            locations = np.concatenate((topIndices, np.broadcast_to(u + np.arange(AbsTile.shape[1]), AbsTile.shape)), axis=1)
+            if values.shape[1] > topK:
+                selected = np.argpartition(-values, topK - 1, axis=1)[:, :topK]
+                values = values[rows[:, None], selected]
+                locations = locations[rows[:, None], selected]
+            (topValues, topIndices) = (values, locations)
+
+    if topK:
+        order = np.argsort(-topValues, axis=1)
+        return peaks, signs, indices, topIndices[rows[:, None], order], topValues[rows[:, None], order]
+    return peaks, signs, indices
+
+class CpaAccumulator:
+    '''Online CPA. Keeps the running sums of traces, squared traces, predictions,
+       squared predictions and prediction x trace products, so that batches of
+       traces can be added in O(1) per trace (w.r.t. the number of traces
+       already added) and the correlation matrix obtained at any moment.
+       To avoid cancellation in the sums, traces and predictions are shifted
+       by the means of the first batch.'''
+
+    def __init__(self, numCandidates, traceLength):
+        '''Allocate the running sums'''
+        self.n = 0
+        self.shiftO = np.zeros(traceLength)
+        self.shiftP = np.zeros(numCandidates)
+        self.sumO = np.zeros(traceLength)
+        self.sumO2 = np.zeros(traceLength)
+        self.sumP = np.zeros(numCandidates)
+        self.sumP2 = np.zeros(numCandidates)
+        self.sumPO = np.zeros((numCandidates, traceLength))
+
+    def addTraces(self, P, O):
+        '''Add a batch of traces O (n,t) with the predictions P (n,m) for them'''
+        if len(O) == 0:
+            return
+        if self.n == 0:
+            self.shiftO = np.mean(O, 0, dtype='float64')
+            self.shiftP = np.mean(P, 0, dtype='float64')
+        DO = O - self.shiftO
+        DP = P - self.shiftP
+        self.n += len(O)
+        self.sumO += np.einsum("nt->t", DO, optimize='optimal')
+        self.sumO2 += np.einsum("nt,nt->t", DO, DO, optimize='optimal')
+        self.sumP += np.einsum("nm->m", DP, optimize='optimal')
+        self.sumP2 += np.einsum("nm,nm->m", DP, DP, optimize='optimal')
+        self.sumPO += np.dot(DP.T, DO)
+
+    def getCorrelation(self):
+        '''Return the (m,t) correlation matrix for all the traces added so far'''
+        n = np.double(self.n)
+        numerator = self.sumPO - np.einsum("m,t->mt", self.sumP, self.sumO / n, optimize='optimal')
+        tmp1 = self.sumP2 - self.sumP ** 2 / n
+        tmp2 = self.sumO2 - self.sumO ** 2 / n
+        tmp = np.einsum("m,t->mt", tmp1, tmp2, optimize='optimal')
+        return numerator / np.sqrt(tmp)
+
+# Correlation traces on conditionally averaged traces, weighting every averaged
+# trace by the number of traces behind it. Since the predictions are constant
+# within a group of averaged traces, this gives exactly the correlation over
+# the non-averaged traces, provided their sum of squares is given.
+# O          - (v,t) array of v averaged traces
+# P          - (v,m) array of predictions for each of the m candidates
+# counts     - (v,) array of the number of traces behind each averaged trace
+# sumSquares - (t,) sum of squares of the non-averaged traces; if None, only the
+#              variance between the averaged traces is used, which scales the
+#              correlation per sample
+# returns an (m,t) correlation matrix
+def correlationTracesWeighted(O, P, counts, sumSquares=None):
+    counts = np.asarray(counts, dtype='float64')
+    n = np.sum(counts)
+
+    meanO = np.dot(counts, O) / n
+    DO = O - meanO                      # compute O - mean(O)
+    DP = P - (np.dot(counts, P) / n)    # compute P - mean(P)
+    WDP = DP * counts[:, None]          # weighted by the counts
+
+    numerator = np.einsum("nm,nt->mt", WDP, DO, optimize='optimal')
+    tmp1 = np.einsum("nm,nm->m", WDP, DP, optimize='optimal')
+    if sumSquares is None:
+        tmp2 = np.einsum("n,nt,nt->t", counts, DO, DO, optimize='optimal')
+    else:
+        tmp2 = sumSquares - n * meanO ** 2
+    tmp = np.einsum("m,t->mt", tmp1, tmp2, optimize='optimal')
+    denominator = np.sqrt(tmp)
+
+    return numerator / denominator
+
 # CPA attack
 # data                 - 1-D array of input bytes
 # traces               - 2-D array of traces
 # intermediateFunction - one of functions like sBoxOut above in the common section
 # leakageFunction      - one of the fucntions like leakgeModelHW above in this section
-def cpaAES(data, traces, intermediateFunction, leakageFunction):
+# counts               - optional number of traces behind each row of traces, when
+#                        these are conditionally averaged; the correlation is then
+#                        weighted to match the one on the non-averaged traces
+# sumSquares           - optional sum of squares of the non-averaged traces, see
+#                        correlationTracesWeighted
+# precision            - precision of the correlation on non-averaged traces, see
+#                        correlationTraces
+def cpaAES(data, traces, intermediateFunction, leakageFunction, counts=None, sumSquares=None, precision='float64'):
 
     traceLength = traces.shape[1]
 
-    # compute intermediate variable predictions
-    k = np.arange(0,256, dtype='uint8') # key chunk candidates
-    H = np.zeros((256, len(data)), dtype='uint8') # intermediate variable predictions
-    for i in range(256):
-        H[i,:] = intermediateFunction(data, k[i])
+    # leakage hypotheses for all the key candidates, gathered from the table
+    HL = hypothesisTableAES(intermediateFunction, leakageFunction)[data]
 
-    # compute leakage hypotheses for every  all the key candidates
-    HL = np.array(map(leakageFunction, H)).T # leakage model here (HW for now)
-
-    CorrTraces = correlationTraces(traces, HL)
+    if counts is None:
+        CorrTraces = correlationTraces(traces, HL, precision)
+    else:
+        CorrTraces = correlationTracesWeighted(traces, HL, counts, sumSquares)
 
     return CorrTraces
 
+# CPA attack on several bytes of the AES state at once, e.g. all 16 for a full key.
+# The traces are centered and their norms computed once, and the hypotheses of
+# all the bytes and key candidates are stacked into one product.
+# data                 - (n,b) array of input bytes, b bytes per trace
+# traces               - 2-D array of traces
+# intermediateFunction - one of functions like sBoxOut above in the common section
+# leakageFunction      - one of the fucntions like leakgeModelHW above in this section
+# peaksOnly            - if True, return only the (b,256) correlation peaks
+#                        (maximum absolute value over the samples)
+# memoryLimit          - memory cap in bytes for the hypotheses and results of the
+#                        bytes processed in one product
+# returns (b,256,t) correlation traces, or (b,256) peaks
+def cpaAESMultiByte(data, traces, intermediateFunction, leakageFunction, peaksOnly=False, memoryLimit=2**28):
+
+    (numTraces, traceLength) = traces.shape
+    numBytes = data.shape[1]
+    table = hypothesisTableAES(intermediateFunction, leakageFunction)
+
+    # center the traces once for all the bytes
+    DO = traces - (np.einsum("nt->t", traces, dtype='float64', optimize='optimal') / np.double(numTraces))
+    tmp2 = np.einsum("nt,nt->t", DO, DO, optimize='optimal')
+
+    if peaksOnly:
+        result = np.empty((numBytes, 256))
+    else:
+        result = np.empty((numBytes, 256, traceLength))
+
+    # bytes per product: hypotheses and correlation traces of the bytes
+    blockSize = int(min(max(memoryLimit // (8 * 256 * (numTraces + traceLength)), 1), numBytes))
+
+    for b in range(0, numBytes, blockSize):
+        byteNums = range(b, min(b + blockSize, numBytes))
+
+        # leakage hypotheses for all the key candidates of all the bytes of the block
+        HL = np.concatenate([table[data[:, byteNum]] for byteNum in byteNums], axis=1).astype('float64')
+
+        DP = HL - (np.einsum("nm->m", HL, optimize='optimal') / np.double(numTraces))
+        numerator = np.dot(DP.T, DO)
+        tmp1 = np.einsum("nm,nm->m", DP, DP, optimize='optimal')
+        CorrTraces = numerator / np.sqrt(np.einsum("m,t->mt", tmp1, tmp2, optimize='optimal'))
+        CorrTraces = CorrTraces.reshape(len(byteNums), 256, traceLength)
+
+        if peaksOnly:
+            result[b:b + len(byteNums)] = np.max(np.abs(CorrTraces), axis=2)
+        else:
+            result[b:b + len(byteNums)] = CorrTraces
+
+    return result
+
 # CPA attack on DES
 # data                 - array of inputs (format depends on intermediateFunction)
 # traces               - 2-D array of traces
 # intermediateFunction - one of functions like sBoxOut above in the common section
 # sBoxNumber           - DES S-box to attack
 # leakageFunction      - one of the fucntions like leakageModelHW above in this section
-def cpaDES(data, traces, intermediateFunction, sBoxNumber, leakageFunction):
+# counts, sumSquares   - optional, for conditionally averaged traces, see cpaAES
+# precision            - precision of the correlation on non-averaged traces, see cpaAES
+def cpaDES(data, traces, intermediateFunction, sBoxNumber, leakageFunction, counts=None, sumSquares=None, precision='float64'):
 
     traceLength = traces.shape[1]
 
@@ -341,8 +897,282 @@ def cpaDES(data, traces, intermediateFunction, sBoxNumber, leakageFunction):
             H[i,j] = intermediateFunction(data[j], k[i], sBoxNumber)
 
     # compute leakage hypotheses for every  all the key candidates
-    HL = np.array(map(leakageFunction, H)).T # leakage model here (HW for now)
+    HL = np.array([leakageFunction(h) for h in H]).T # leakage model here (HW for now)
 
-    CorrTraces = correlationTraces(traces, HL)
+    if counts is None:
+        CorrTraces = correlationTraces(traces, HL, precision)
+    else:
+        CorrTraces = correlationTracesWeighted(traces, HL, counts, sumSquares)
 
     return CorrTraces
+
+##############################################################################
+### C. CPA by fast Walsh-Hadamard transform
+# When the intermediate value depends on the data and the key only through
+# data XOR key, the predictions of candidate k are those of candidate 0
+# permuted by XOR with k. The CPA numerators (and the sums of predictions in
+# the denominators) for all the candidates are then XOR-convolutions along the
+# data value axis, computed with a fast Walsh-Hadamard transform in
+# O(v log v t) instead of O(v m t).
+
+# Unnormalized fast Walsh-Hadamard transform along the first axis.
+# The Hadamard matrix of size 2^b is a Kronecker product of smaller ones, so
+# the first axis is split into chunks of up to maxBits bits and every chunk
+# is transformed with a small Hadamard matrix product (few BLAS calls instead
+# of b butterfly passes).
+# a       - array with the first dimension being a power of 2
+# maxBits - largest chunk
+# returns the transformed array (a is not modified)
+def fastWalshHadamard(a, maxBits=4):
+    a = np.asarray(a, dtype='float64')
+    shape = a.shape
+    bits = shape[0].bit_length() - 1
+    chunks = [maxBits] * (bits // maxBits)
+    if bits % maxBits:
+        chunks.append(bits % maxBits)
+    a = a.reshape([2 ** c for c in chunks] + [-1])
+    for (i, c) in enumerate(chunks):
+        x = np.arange(0, 2 ** c)
+        H = np.where(byteHammingWeight[x[:, None] & x[None, :]] & 1, -1.0, 1.0) # (-1)^<i,j>
+        a = np.moveaxis(np.tensordot(H, a, axes=([1], [i])), 0, i)
+    return a.reshape(shape)
+
+# Correlation traces for all candidates k of predictions with XOR structure:
+# the prediction for candidate k and data value (x,y) is h[x ^ k, y], where y
+# is a part of the data value not mixed with the key (absent for AES).
+# h          - (m,g) array of predictions of candidate 0
+# counts     - (m,g) array of the number of traces per data value
+# sums       - (m,g,t) array of the sums of traces per data value
+# sumSquares - (t,) sum of squared traces; if None, only the variance between
+#              the per-value means is used, as in correlationTracesWeighted
+# returns an (m,t) correlation matrix
+def correlationTracesXor(h, counts, sums, sumSquares=None):
+    m = h.shape[0]
+    n = np.sum(counts)
+    meanO = np.sum(sums, axis=(0, 1)) / n
+    DS = sums - counts[:, :, None] * meanO # sums of centered traces per value
+
+    # transforms of the per-value quantities
+    Wh = fastWalshHadamard(h)
+    Wh2 = fastWalshHadamard(h ** 2)
+    Wc = fastWalshHadamard(counts)
+    WDS = fastWalshHadamard(DS)
+
+    # XOR-convolutions, the sum over g is done before the inverse transform
+    numerator = fastWalshHadamard(np.einsum('xg,xgt->xt', Wh, WDS, optimize='optimal')) / m
+    sumP = fastWalshHadamard(np.einsum('xg,xg->x', Wh, Wc)) / m
+    sumP2 = fastWalshHadamard(np.einsum('xg,xg->x', Wh2, Wc)) / m
+
+    tmp1 = sumP2 - sumP ** 2 / n
+    if sumSquares is None:
+        observed = counts > 0
+        tmp2 = np.einsum('it,it->t', DS[observed], DS[observed] / counts[observed][:, None], optimize='optimal')
+    else:
+        tmp2 = sumSquares - n * meanO ** 2
+    tmp = np.einsum("m,t->mt", tmp1, tmp2, optimize='optimal')
+    denominator = np.sqrt(tmp)
+
+    return numerator / denominator
+
+# Per-value statistics for the XOR-structured CPA, from either non-averaged
+# traces (counts is None) or conditionally averaged ones
+# returns (v,) counts, (v,t) sums and (t,) sum of squares or None
+def xorCpaStatistics(data, traces, numValues, counts, sumSquares):
+    if counts is None:
+        (counts, sums) = conditionalSums(data, traces, numValues)
+        sumSquares = np.einsum('nt,nt->t', traces, traces, dtype='float64', optimize='optimal')
+    else:
+        counts = np.asarray(counts, dtype='float64')
+        sums = np.zeros((numValues, traces.shape[1]))
+        sums[data] = traces * counts[:, None]
+        counts = np.bincount(data, weights=counts, minlength=numValues)
+    return counts, sums, sumSquares
+
+# CPA attack on AES with the fast Walsh-Hadamard transform. Gives the same result
+# as cpaAES, but requires intermediateFunction(data, k) to depend on data ^ k
+# only, which holds for all the AES functions in the common section.
+# Parameters are the same as for cpaAES. Without counts, traces are not averaged
+# and are grouped by data value first.
+def cpaAESWalsh(data, traces, intermediateFunction, leakageFunction, counts=None, sumSquares=None):
+
+    # check the XOR structure of the predictions
+    H = intermediateValuesAES(intermediateFunction)
+    x = np.arange(0, 256)
+    if not np.array_equal(H, H[0][x[:, None] ^ x[None, :]]):
+        raise ValueError("%s does not depend on data XOR key only" % intermediateFunction.__name__)
+
+    h = np.asarray(leakageFunction(H[0]), dtype='float64')[:, None] # predictions of candidate 0
+    data = np.asarray(data, dtype='int64')
+    (counts, sums, sumSquares) = xorCpaStatistics(data, traces, 256, counts, sumSquares)
+
+    return correlationTracesXor(h, counts[:, None], sums[:, None, :], sumSquares)
+
+# CPA attack on DES with the fast Walsh-Hadamard transform, for averaging values
+# packed as in roundXOR_valueForAveraging: 6 S-box input bits (mixed with the
+# key chunk) followed by 4 bits that are not. Gives the same result as cpaDES
+# with roundXOR_targetVariable.
+# Parameters are the same as for cpaDES.
+def cpaDESWalsh(data, traces, intermediateFunction, sBoxNumber, leakageFunction, counts=None, sumSquares=None):
+
+    # check the XOR structure of the predictions
+    H = intermediateValuesDES(intermediateFunction, sBoxNumber)
+    v = np.arange(0, 1024)
+    k = np.arange(0, 64)
+    if not np.array_equal(H, H[0][v[None, :] ^ (k[:, None] << 4)]):
+        raise ValueError("%s does not depend on data XOR key only" % intermediateFunction.__name__)
+
+    h = np.asarray(leakageFunction(H[0]), dtype='float64').reshape(64, 16) # predictions of candidate 0
+    data = np.asarray(data, dtype='int64')
+    (counts, sums, sumSquares) = xorCpaStatistics(data, traces, 1024, counts, sumSquares)
+
+    return correlationTracesXor(h, counts.reshape(64, 16), sums.reshape(64, 16, -1), sumSquares)
+
+##############################################################################
+### D. Key rank evolution
+# The correct key rank as a function of the number of traces, for a set of
+# trace prefixes. The per-value counts and sums of the traces are accumulated
+# over the chunks between consecutive prefixes, so the data is swept once, and
+# CPA (weighted, see correlationTracesWeighted) and LRA (see lraStatistics) at
+# every prefix are computed from the statistics at a cost not depending on the
+# number of traces.
+
+# Rank of the correct key candidate, counting the candidates with a peak at
+# least as high (so that ties count against the correct candidate)
+# peaks      - (m,) array of peaks, e.g. np.max(np.abs(CorrTraces), axis=1)
+# correctKey - index of the correct candidate
+def correctKeyRank(peaks, correctKey):
+    return np.count_nonzero(peaks >= peaks[correctKey])
+
+# Key rank evolution from data values and traces
+# values                - 1-D array of n data values in range(v)
+# traces                - (n,t) array of traces
+# intermediateVariables - (m,v) array of predictions of each of the m key
+#                         candidates for each of the v data values
+# leakageFunction       - leakage function for CPA, or None to skip CPA
+# basisFunctionsModel   - basis functions model for LRA, or None to skip LRA
+# bitWidth              - bit width of the intermediate variable
+# correctKey            - index of the correct key candidate
+# traceNumbers          - increasing numbers of traces (prefix sizes) to rank at
+# memoryLimit           - memory cap in bytes for a block of LRA candidates
+# returns traceNumbers and (s,) arrays of correct key ranks for CPA and LRA,
+# and (s,m) arrays of peaks of CPA (absolute correlation) and LRA (R2) per
+# candidate, for the s prefixes; the results of a skipped attack are None
+def rankEvolution(values, traces, intermediateVariables, leakageFunction, basisFunctionsModel, bitWidth,
+                  correctKey, traceNumbers, memoryLimit=2**28):
+
+    values = np.asarray(values)
+    traceNumbers = np.asarray(traceNumbers)
+    (numCandidates, numValues) = intermediateVariables.shape
+    numSteps = len(traceNumbers)
+
+    if leakageFunction is not None:
+        HL = np.asarray(leakageFunction(intermediateVariables), dtype='float64').T
+        peaksCPA = np.zeros((numSteps, numCandidates))
+    if basisFunctionsModel is not None:
+        peaksLRA = np.zeros((numSteps, numCandidates))
+
+    counts = np.zeros(numValues)
+    sums = np.zeros((numValues, traces.shape[1]))
+    sumSquares = np.zeros(traces.shape[1])
+
+    start = 0
+    for (s, end) in enumerate(traceNumbers):
+
+        # accumulate the statistics of the traces since the previous prefix
+        (chunkCounts, chunkSums) = conditionalSums(values[start:end], traces[start:end], numValues)
+        counts += chunkCounts
+        sums += chunkSums
+        sumSquares += np.einsum('nt,nt->t', traces[start:end], traces[start:end], dtype='float64', optimize='optimal')
+        start = end
+
+        observed = np.flatnonzero(counts)
+        if leakageFunction is not None:
+            CorrTraces = correlationTracesWeighted(sums[observed] / counts[observed, None], HL[observed],
+                                                  counts[observed], sumSquares)
+            peaksCPA[s] = np.max(np.abs(CorrTraces), axis=1)
+        if basisFunctionsModel is not None:
+            R2 = lraStatistics(counts, sums, sumSquares, intermediateVariables, basisFunctionsModel, bitWidth, memoryLimit)
+            peaksLRA[s] = np.max(R2, axis=1)
+
+    rankCPA = rankLRA = None
+    if leakageFunction is not None:
+        rankCPA = np.array([correctKeyRank(p, correctKey) for p in peaksCPA])
+    else:
+        peaksCPA = None
+    if basisFunctionsModel is not None:
+        rankLRA = np.array([correctKeyRank(p, correctKey) for p in peaksLRA])
+    else:
+        peaksLRA = None
+
+    return traceNumbers, rankCPA, rankLRA, peaksCPA, peaksLRA
+
+# Key rank evolution of CPA and LRA on AES
+# data                 - 1-D array of input bytes
+# traces               - 2-D array of traces
+# intermediateFunction - one of the functions like sBoxOut in the common section
+# leakageFunction      - leakage function for CPA, or None to skip CPA
+# basisFunctionsModel  - basis functions model for LRA, or None to skip LRA
+# correctKey           - correct key byte
+# traceNumbers         - increasing numbers of traces to rank at
+# returns the same as rankEvolution
+def rankEvolutionAES(data, traces, intermediateFunction, leakageFunction, basisFunctionsModel, correctKey, traceNumbers,
+                     memoryLimit=2**28):
+    return rankEvolution(data, traces, intermediateValuesAES(intermediateFunction), leakageFunction,
+                         basisFunctionsModel, 8, correctKey, traceNumbers, memoryLimit)
+
+# Key rank evolution of CPA and LRA on DES
+# data                 - 1-D array of averaging values (like from
+#                        roundXOR_valueForAveraging)
+# intermediateFunction - function of the averaging value like roundXOR_targetVariable
+# sBoxNumber           - DES S-box to attack
+# correctKey           - correct key chunk
+# numValues            - number of possible averaging values
+# other parameters and the result are the same as for rankEvolutionAES
+def rankEvolutionDES(data, traces, intermediateFunction, sBoxNumber, leakageFunction, basisFunctionsModel, correctKey,
+                     traceNumbers, numValues=1024, memoryLimit=2**28):
+    return rankEvolution(data, traces, intermediateValuesDES(intermediateFunction, sBoxNumber, numValues),
+                         leakageFunction, basisFunctionsModel, 4, correctKey, traceNumbers, memoryLimit)
+
+# Numbers of traces to rank at: every evolutionStep traces and the last one
+# numTraces     - total number of traces
+# evolutionStep - step between the numbers of traces
+# tracesToSkip  - smallest number of traces to rank at (warm-up, avoiding
+#                 singular regressions on too few traces)
+def evolutionTraceNumbers(numTraces, evolutionStep, tracesToSkip=0):
+    traceNumbers = np.append(np.arange(evolutionStep, numTraces, evolutionStep), numTraces)
+    return traceNumbers[traceNumbers >= tracesToSkip]
+
+# Save the key rank evolution to an npz file for later processing; the arrays
+# of a skipped attack (None) are not saved
+def saveRankEvolution(filename, traceNumbers, rankCPA, rankLRA):
+    arrays = {'traceNumbers': traceNumbers}
+    if rankCPA is not None:
+        arrays['kreCPA'] = rankCPA
+    if rankLRA is not None:
+        arrays['kreLRA'] = rankLRA
+    np.savez(filename, **arrays)
+
+
+#############################################################################
+### Self-tests
+
+def testCorrelationTiles():
+    ''' Number of tiles of correlationTiles for a memory limit fitting exactly
+        64 samples of the temporaries, and the tiled correlation against
+        correlationTraces. Fails with an AssertionError.'''
+    (n, m, t) = (100, 256, 1000)
+    O = np.random.randint(-128, 128, (n, t)).astype('int8')
+    P = np.random.randint(0, 9, (n, m)).astype('uint8')
+    memoryLimit = 8 * (2 * n + 3 * m) * 64
+    tiles = [(u, CorrTile.shape[1]) for (u, CorrTile) in correlationTiles(O, P, memoryLimit)]
+    assert len(tiles) == 16 and tiles[-1] == (960, 40)
+    assert [CorrTile.shape[1] for (u, CorrTile) in correlationTiles(O, P, memoryLimit - 1)][0] == 63
+    assert np.allclose(correlationTracesTiled(O, P, memoryLimit), correlationTraces(O, P))
+    print("testCorrelationTiles: OK")
+
+
+#############################################################################
+### Entrypoint for self-testing
+
+if __name__ == "__main__":
+    testCorrelationTiles()
@@ -0,0 +1,250 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Parallel driver for the attacks from lracpa module: the attacks on different
+AES key bytes or DES S-boxes are independent, so they are run as jobs in a
+pool of worker processes.
+
+The trace matrix is copied once into shared memory and mapped by every worker,
+so it is not pickled per job. Each worker limits the number of threads of the
+BLAS library, so that the pool does not oversubscribe the cores: via
+threadpoolctl if installed, and otherwise by calling the thread setting
+function of the loaded OpenBLAS, MKL or BLIS through ctypes (found in
+/proc/self/maps, so on Linux only). The BLAS threads environment variables
+(OMP_NUM_THREADS etc.) are read only when numpy is imported, so elsewhere the
+script has to be started with them already set.
+
+The conditional averagers can be run the same way over the shards of a
+traceset (e.g. the files of an acquisition campaign): every worker averages
+whole files, and the averagers of the shards are merged into one.
+
+The scripts using this module should have the main code under
+if __name__ == "__main__", as the worker processes import the main module on
+platforms without fork.
+'''
+
+import os
+import ctypes
+import multiprocessing
+import numpy as np
+
+from ttest import traceChunks
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# functions setting the number of threads of the common BLAS libraries, by
+# part of the library file name (numpy wheels bundle OpenBLAS with a prefix
+# and a suffix on the symbols)
+blasThreadFunctions = [("openblas", ["openblas_set_num_threads", "openblas_set_num_threads64_",
+                                     "scipy_openblas_set_num_threads64_", "scipy_openblas_set_num_threads"]),
+                       ("mkl_rt", ["MKL_Set_Num_Threads"]),
+                       ("blis", ["bli_thread_set_num_threads"])]
+
+# state of a worker process, set by initWorker
+workerTraces  = None
+workerLimits  = None
+
+
+#############################################################################
+### Workers
+
+# Limit the number of threads of the BLAS libraries loaded in this process by
+# calling their own thread setting functions
+# threads - number of threads
+# returns the number of libraries limited (0 where /proc/self/maps is missing)
+def limitBlasThreads(threads):
+    paths = set()
+    try:
+        with open("/proc/self/maps") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 5 and fields[5].startswith("/"):
+                    paths.add(fields[5])
+    except IOError:
+        return 0
+    limited = 0
+    for path in sorted(paths):
+        name = os.path.basename(path)
+        for (library, functions) in blasThreadFunctions:
+            if library not in name:
+                continue
+            try:
+                lib = ctypes.CDLL(path)
+            except OSError:
+                continue
+            for function in functions:
+                if hasattr(lib, function):
+                    getattr(lib, function)(threads)
+                    limited += 1
+                    break
+    return limited
+
+# Initializer of a worker process: map the shared traces and limit BLAS threads
+# sharedTraces - RawArray holding the traces, or None for workers reading
+#                their own traces
+# dtype, shape - type and shape of the traces
+# blasThreads  - number of BLAS threads in the worker
+def initWorker(sharedTraces, dtype, shape, blasThreads):
+    global workerTraces, workerLimits
+    if threadpool_limits is not None:
+        workerLimits = threadpool_limits(limits=blasThreads)
+    else:
+        limitBlasThreads(blasThreads)
+    if sharedTraces is not None:
+        workerTraces = np.frombuffer(sharedTraces, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+# Run one job in a worker
+# job - tuple (attack, data, args, kwargs), the attack is called as
+#       attack(data, traces, *args, **kwargs)
+def runJob(job):
+    (attack, data, args, kwargs) = job
+    return attack(data, workerTraces, *args, **kwargs)
+
+# Average one shard of a traceset in a worker
+# job - tuple (source, newAverager, addArgs, dataColumns, chunkSize, sampleRange),
+#       see averageTracesets
+# returns the averager, or None for a shard without traces
+def averageShard(job):
+    (source, newAverager, addArgs, dataColumns, chunkSize, sampleRange) = job
+    averager = None
+    for (data, traces) in traceChunks(source, chunkSize, sampleRange):
+        if averager is None:
+            averager = newAverager(traces.shape[1])
+        if dataColumns is not None:
+            data = data[:, dataColumns]
+        averager.addTraces(data, traces, *addArgs)
+    return averager
+
+
+#############################################################################
+### Driver
+
+# Copy the traces into shared memory
+# returns the RawArray
+def sharedTracesCopy(traces):
+    traces = np.ascontiguousarray(traces)
+    sharedTraces = multiprocessing.RawArray('b', max(traces.nbytes, 1))
+    np.frombuffer(sharedTraces, dtype=traces.dtype, count=traces.size).reshape(traces.shape)[...] = traces
+    return sharedTraces
+
+# Stack the results of the jobs into arrays with the job as the first axis;
+# for attacks returning tuples (like lraAES) every element is stacked, and
+# elements that are None stay None
+def gatherResults(results):
+    if isinstance(results[0], tuple):
+        return tuple(gatherResults(list(r)) for r in zip(*results))
+    if results[0] is None:
+        return None
+    return np.array(results)
+
+# Run jobs in a pool of worker processes
+# worker      - function run on every job, like runJob
+# jobs        - list of jobs
+# processes   - number of worker processes
+# blasThreads - number of BLAS threads per worker
+# traceArgs   - shared traces, their type and shape for initWorker
+# returns list of the results of the jobs, in the order of the jobs
+def mapJobs(worker, jobs, processes, blasThreads, traceArgs=(None, None, None)):
+    pool = multiprocessing.Pool(processes, initWorker, tuple(traceArgs) + (blasThreads,))
+    try:
+        results = pool.map(worker, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+# Run attack jobs in a pool of worker processes sharing the traces
+# jobs        - list of tuples (attack, data, args, kwargs), see runJob
+# traces      - 2-D array of traces, common to all the jobs
+# processes   - number of worker processes, by default the number of cores
+# blasThreads - number of BLAS threads per worker
+# returns list of the results of the jobs, in the order of the jobs
+def runParallel(jobs, traces, processes=None, blasThreads=1):
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(min(processes, len(jobs)), 1)
+
+    traces = np.ascontiguousarray(traces)
+    sharedTraces = sharedTracesCopy(traces)
+    return mapJobs(runJob, jobs, processes, blasThreads, (sharedTraces, traces.dtype, traces.shape))
+
+# Attack several AES key bytes in parallel, one job per byte
+# attack               - cpaAES or lraAES from lracpa
+# data                 - (n,b) array of input bytes, b bytes per trace
+# traces               - 2-D array of traces
+# intermediateFunction - one of the functions like sBoxOut in lracpa
+# model                - leakage function for cpaAES, basis functions model for lraAES
+# byteNumbers          - bytes to attack, by default all the b bytes
+# processes            - number of worker processes, by default the number of cores
+# blasThreads          - number of BLAS threads per worker
+# kwargs               - further keyword arguments of the attack
+# returns the results of the attack stacked over the bytes, e.g. (b,256,t)
+# correlation traces for cpaAES, or (b,256,t) R2 and coefficients for lraAES
+def attackAESBytes(attack, data, traces, intermediateFunction, model, byteNumbers=None, processes=None,
+                   blasThreads=1, **kwargs):
+    if byteNumbers is None:
+        byteNumbers = range(data.shape[1])
+    jobs = [(attack, data[:, j], (intermediateFunction, model), kwargs) for j in byteNumbers]
+    return gatherResults(runParallel(jobs, traces, processes, blasThreads))
+
+# Attack several DES S-boxes in parallel, one job per S-box
+# attack               - cpaDES or lraDES from lracpa
+# data                 - array of inputs common to all the S-boxes (format
+#                        depends on intermediateFunction, e.g. 64-bit inputs
+#                        for roundXOR_allInOne), or a list holding the inputs
+#                        of each S-box
+# traces               - 2-D array of traces
+# intermediateFunction - one of the functions like roundXOR_allInOne in desutils
+# model                - leakage function for cpaDES, basis functions model for lraDES
+# sBoxNumbers          - S-boxes to attack, by default all 8
+# processes            - number of worker processes, by default the number of cores
+# blasThreads          - number of BLAS threads per worker
+# kwargs               - further keyword arguments of the attack
+# returns the results of the attack stacked over the S-boxes, e.g. (s,64,t)
+# correlation traces for cpaDES, or (s,64,t) R2 and coefficients for lraDES
+def attackDESSboxes(attack, data, traces, intermediateFunction, model, sBoxNumbers=range(8), processes=None,
+                    blasThreads=1, **kwargs):
+    if isinstance(data, list) and len(data) == len(sBoxNumbers) and np.ndim(data[0]) == 1:
+        sBoxData = data
+    else:
+        sBoxData = [data] * len(sBoxNumbers)
+    jobs = [(attack, d, (intermediateFunction, s, model), kwargs) for (d, s) in zip(sBoxData, sBoxNumbers)]
+    return gatherResults(runParallel(jobs, traces, processes, blasThreads))
+
+# Conditionally average a traceset split in shards (e.g. files), one job per
+# shard, and merge the averagers of the shards
+# sources     - list of shards, each a trs or npz file name or another
+#               source accepted by ttest.traceChunks
+# newAverager - function of the trace length returning an empty averager,
+#               e.g. functools.partial(ConditionalAveragerAesSbox, 256); it
+#               is pickled to the workers, so it cannot be a lambda
+# addArgs     - further arguments of the addTraces of the averager, e.g.
+#               (roundXOR_valueForAveraging, sBoxNumber) for ConditionalAveragerDes
+# dataColumns - columns of the data passed to addTraces, e.g. the byte number
+#               for ConditionalAveragerAesSbox, None for all the data
+# chunkSize   - number of traces read at once
+# sampleRange - optional range of samples (low, high)
+# processes   - number of worker processes, by default the number of cores
+# blasThreads - number of BLAS threads per worker
+# returns the averager of all the shards
+def averageTracesets(sources, newAverager, addArgs=(), dataColumns=None, chunkSize=1000, sampleRange=None,
+                     processes=None, blasThreads=1):
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(min(processes, len(sources)), 1)
+
+    jobs = [(source, newAverager, tuple(addArgs), dataColumns, chunkSize, sampleRange) for source in sources]
+    averager = None
+    for shardAverager in mapJobs(averageShard, jobs, processes, blasThreads):
+        if averager is None:
+            averager = shardAverager
+        elif shardAverager is not None:
+            averager.merge(shardAverager)
+    return averager
@@ -0,0 +1,84 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Point-of-interest (POI) selection: rank the samples by a cheap score (SNR,
+envelope of CPA over all key candidates, or variance) and keep a budget of the
+best ones, as indices or as windows, before running the expensive LRA on them.
+The cost of LRA is linear in the number of samples.
+
+Usage example:
+    indices = selectSamples(snrScores(data, traces, 256), budget=0.05)
+    R2, coefs = lraAES(data, traces[:, indices], sBoxOut, basisModelSingleBits)
+    # column j of R2 is sample indices[j] of the traces
+'''
+
+import numpy as np
+
+from condaveraes import ConditionalAveragerAesSbox
+
+
+#############################################################################
+### Scores
+
+# Signal-to-noise ratio Var(E[T|X]) / E[Var(T|X)] per sample in one pass,
+# with a conditional averager (the snr(), or nicv(), of an averager filled
+# already can be used as scores directly)
+# values    - 1-D array of n data values in range(numValues), e.g. plaintext
+#             bytes for AES or averaging values for DES
+# traces    - (n,t) array of traces
+# numValues - number of possible data values
+def snrScores(values, traces, numValues):
+    averager = ConditionalAveragerAesSbox(numValues, traces.shape[1])
+    averager.addTraces(values, traces)
+    return averager.snr()
+
+# Envelope of CPA: the maximum absolute correlation over all key candidates
+# per sample, e.g. from cpaAES or cpaAESWalsh on a modest number of traces
+# CorrTraces - (m,t) correlation traces
+def cpaEnvelopeScores(CorrTraces):
+    return np.max(np.abs(CorrTraces), axis=0)
+
+# Variance of the traces per sample, for when nothing is known about the target
+def varianceScores(traces):
+    return np.var(traces, axis=0, dtype='float64')
+
+
+#############################################################################
+### Selection
+
+# Indices of the best samples by score
+# scores - (t,) score per sample
+# budget - fraction of the samples to keep if below 1 (e.g. 0.05 for the top
+#          5%), otherwise the number of samples to keep
+# returns sorted array of sample indices
+def selectSamples(scores, budget=0.05):
+    scores = np.nan_to_num(np.asarray(scores, dtype='float64'))
+    if budget < 1:
+        count = int(np.ceil(budget * len(scores)))
+    else:
+        count = int(budget)
+    count = min(max(count, 1), len(scores))
+    return np.sort(np.argsort(-scores, kind='mergesort')[:count])
+
+# Windows covering the selected samples, merging the ones that are close
+# indices     - sorted array of sample indices, see selectSamples
+# traceLength - number of samples in a trace
+# margin      - number of samples added on both sides of every index
+# gap         - windows closer than this are merged
+# returns list of windows (low, high), in the format of sampleRange
+def sampleWindows(indices, traceLength, margin=0, gap=1):
+    windows = []
+    for i in indices:
+        (low, high) = (int(max(i - margin, 0)), int(min(i + margin + 1, traceLength)))
+        if windows and low <= windows[-1][1] + gap - 1:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], high))
+        else:
+            windows.append((low, high))
+    return windows
+
+# Indices of all the samples in windows, to select them from the traces
+# at once, like traces[:, windowIndices(windows)]
+def windowIndices(windows):
+    return np.concatenate([np.arange(low, high) for (low, high) in windows])
@@ -0,0 +1,241 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Success rate (SR) and guessing entropy (GE) of CPA and LRA, estimated over many
+random orderings (or bootstrap resamplings) of the traces.
+
+A repetition is a sequence of trace indices. For every repetition, the counts
+and sums of the traces per data value and the sum of squared traces are grown
+over the chunks between the requested numbers of traces, all the repetitions
+at once by grouping on (repetition, data value). CPA and LRA at each number of
+traces are then computed from these statistics (as in lracpa.rankEvolution),
+so the cost of a repetition does not depend on the number of traces, and the
+CPA of all the repetitions is one batched product.
+'''
+
+import numpy as np
+
+from lracpa import conditionalSums, lraStatistics, correctKeyRank, intermediateValuesAES, intermediateValuesDES
+
+
+#############################################################################
+### Resampling
+
+# Random trace orders for the repetitions
+# numTraces      - number of available traces
+# numRepetitions - number of repetitions
+# maxTraces      - number of traces per repetition, at most numTraces unless
+#                  bootstrap is True
+# bootstrap      - if False, each repetition is a random subset of the traces in
+#                  random order (drawn without replacement); if True, the
+#                  traces are drawn with replacement
+# seed           - seed of the random generator, for reproducible results
+# returns (numRepetitions,maxTraces) array of trace indices
+def resampleOrders(numTraces, numRepetitions, maxTraces, bootstrap=False, seed=None):
+    rng = np.random.RandomState(seed)
+    if bootstrap:
+        return rng.randint(0, numTraces, (numRepetitions, maxTraces))
+    if maxTraces > numTraces:
+        raise ValueError("cannot draw %d out of %d traces without replacement" % (maxTraces, numTraces))
+    return np.array([rng.permutation(numTraces)[:maxTraces] for r in range(numRepetitions)])
+
+
+#############################################################################
+### Ranks over the repetitions
+
+# Peaks of CPA (absolute correlation) for a block of repetitions from their statistics
+# counts     - (r,v) number of traces per data value
+# sums       - (r,v,t) sum of traces per data value
+# sumSquares - (r,t) sum of squared traces
+# HL         - (v,m) leakage hypotheses per data value and key candidate
+# returns (r,m) array of peaks
+def cpaPeaksStatistics(counts, sums, sumSquares, HL):
+    n = np.sum(counts, 1)[:, None]
+    sumO = np.sum(sums, 1)
+    sumP = np.dot(counts, HL)
+    sumP2 = np.dot(counts, HL ** 2)
+    numerator = np.matmul(HL.T[None, :, :], sums) - sumP[:, :, None] * (sumO / n)[:, None, :]
+    tmp1 = sumP2 - sumP ** 2 / n
+    tmp2 = sumSquares - sumO ** 2 / n
+    CorrTraces = numerator / np.sqrt(tmp1[:, :, None] * tmp2[:, None, :])
+    return np.max(np.abs(CorrTraces), axis=2)
+
+# Ranks of the correct key candidate for every repetition and number of traces
+# values                - 1-D array of n data values in range(v)
+# traces                - (n,t) array of traces
+# intermediateVariables - (m,v) array of predictions of each of the m key
+#                         candidates for each of the v data values
+# leakageFunction       - leakage function for CPA, or None to skip CPA
+# basisFunctionsModel   - basis functions model for LRA, or None to skip LRA
+# bitWidth              - bit width of the intermediate variable
+# correctKey            - index of the correct key candidate
+# traceNumbers          - increasing numbers of traces to rank at; the smallest
+#                         should be large enough for the regression to be
+#                         solvable (see tracesToSkip in the attack scripts),
+#                         LRA on a repetition with a singular regression gets
+#                         the worst rank
+# orders                - (R,maxTraces) trace indices of the R repetitions, see
+#                         resampleOrders; maxTraces at least the last of traceNumbers
+# memoryLimit           - memory cap in bytes for the temporary arrays (the
+#                         statistics of all the repetitions, (R,v,t) sums, are
+#                         kept in addition)
+# returns (R,s) arrays of ranks for CPA and LRA (None for a skipped attack)
+def resampledRanks(values, traces, intermediateVariables, leakageFunction, basisFunctionsModel, bitWidth,
+                   correctKey, traceNumbers, orders, memoryLimit=2**28):
+
+    values = np.asarray(values)
+    (numCandidates, numValues) = intermediateVariables.shape
+    (numRepetitions, maxTraces) = orders.shape
+    traceLength = traces.shape[1]
+    traceNumbers = np.asarray(traceNumbers)
+    if traceNumbers[-1] > maxTraces:
+        raise ValueError("orders have %d traces, %d requested" % (maxTraces, traceNumbers[-1]))
+
+    if leakageFunction is not None:
+        HL = np.asarray(leakageFunction(intermediateVariables), dtype='float64').T
+        ranksCPA = np.zeros((numRepetitions, len(traceNumbers)), dtype='int64')
+    if basisFunctionsModel is not None:
+        ranksLRA = np.zeros((numRepetitions, len(traceNumbers)), dtype='int64')
+
+    counts = np.zeros((numRepetitions, numValues))
+    sums = np.zeros((numRepetitions, numValues, traceLength))
+    sumSquares = np.zeros((numRepetitions, traceLength))
+
+    # repetitions per block of the batched CPA
+    cpaBlock = int(min(max(memoryLimit // (8 * numCandidates * traceLength), 1), numRepetitions))
+
+    start = 0
+    for (s, end) in enumerate(traceNumbers):
+
+        # repetitions per block of gathered traces of this chunk
+        chunkLength = max(end - start, 1)
+        gatherBlock = int(min(max(memoryLimit // (8 * chunkLength * traceLength), 1), numRepetitions))
+
+        # grow the statistics by the chunk of traces, grouping on (repetition, value)
+        for r in range(0, numRepetitions, gatherBlock):
+            idx = orders[r:r + gatherBlock, start:end]
+            rb = idx.shape[0]
+            keys = (np.arange(rb)[:, None] * numValues + values[idx]).ravel()
+            chunk = traces[idx.ravel()]
+            (chunkCounts, chunkSums) = conditionalSums(keys, chunk, rb * numValues)
+            counts[r:r + rb] += chunkCounts.reshape(rb, numValues)
+            sums[r:r + rb] += chunkSums.reshape(rb, numValues, traceLength)
+            chunk = chunk.reshape(rb, -1, traceLength)
+            sumSquares[r:r + rb] += np.einsum('rnt,rnt->rt', chunk, chunk, dtype='float64', optimize='optimal')
+        start = end
+
+        # rank at this number of traces
+        if leakageFunction is not None:
+            for r in range(0, numRepetitions, cpaBlock):
+                peaks = cpaPeaksStatistics(counts[r:r + cpaBlock], sums[r:r + cpaBlock], sumSquares[r:r + cpaBlock], HL)
+                ranksCPA[r:r + cpaBlock, s] = [correctKeyRank(p, correctKey) for p in peaks]
+        if basisFunctionsModel is not None:
+            for r in range(numRepetitions):
+                try:
+                    R2 = lraStatistics(counts[r], sums[r], sumSquares[r], intermediateVariables, basisFunctionsModel,
+                                       bitWidth, memoryLimit)
+                    ranksLRA[r, s] = correctKeyRank(np.max(R2, axis=1), correctKey)
+                except np.linalg.LinAlgError:
+                    ranksLRA[r, s] = numCandidates # too few distinct values drawn, count as a failure
+
+    if leakageFunction is None:
+        ranksCPA = None
+    if basisFunctionsModel is None:
+        ranksLRA = None
+    return ranksCPA, ranksLRA
+
+# Ranks over the repetitions for AES
+# data                 - 1-D array of input bytes
+# traces               - 2-D array of traces
+# intermediateFunction - one of the functions like sBoxOut in lracpa
+# leakageFunction      - leakage function for CPA, or None to skip CPA
+# basisFunctionsModel  - basis functions model for LRA, or None to skip LRA
+# correctKey           - correct key byte
+# traceNumbers         - increasing numbers of traces to rank at
+# numRepetitions       - number of repetitions
+# bootstrap, seed      - see resampleOrders
+# returns the same as resampledRanks
+def resampledRanksAES(data, traces, intermediateFunction, leakageFunction, basisFunctionsModel, correctKey,
+                      traceNumbers, numRepetitions=100, bootstrap=False, seed=None, memoryLimit=2**28):
+    orders = resampleOrders(len(data), numRepetitions, traceNumbers[-1], bootstrap, seed)
+    return resampledRanks(data, traces, intermediateValuesAES(intermediateFunction), leakageFunction,
+                          basisFunctionsModel, 8, correctKey, traceNumbers, orders, memoryLimit)
+
+# Ranks over the repetitions for DES
+# data                 - 1-D array of averaging values (like from
+#                        roundXOR_valueForAveraging)
+# intermediateFunction - function of the averaging value like roundXOR_targetVariable
+# sBoxNumber           - DES S-box to attack
+# correctKey           - correct key chunk
+# numValues            - number of possible averaging values
+# other parameters and the result are the same as for resampledRanksAES
+def resampledRanksDES(data, traces, intermediateFunction, sBoxNumber, leakageFunction, basisFunctionsModel, correctKey,
+                      traceNumbers, numRepetitions=100, bootstrap=False, seed=None, numValues=1024, memoryLimit=2**28):
+    orders = resampleOrders(len(data), numRepetitions, traceNumbers[-1], bootstrap, seed)
+    return resampledRanks(data, traces, intermediateValuesDES(intermediateFunction, sBoxNumber, numValues),
+                          leakageFunction, basisFunctionsModel, 4, correctKey, traceNumbers, orders, memoryLimit)
+
+
+#############################################################################
+### Metrics
+
+# Success rate of order o: the fraction of the repetitions where the correct
+# candidate is among the o best, with the Wilson score confidence interval
+# ranks - (R,s) array of ranks, see resampledRanks
+# order - success order, 1 for the correct candidate being the best
+# z     - quantile of the standard normal distribution for the confidence
+#         level, 1.96 for two-sided 95%
+# returns (s,) arrays of the success rate and the lower and upper bounds
+def successRate(ranks, order=1, z=1.96):
+    numRepetitions = ranks.shape[0]
+    sr = np.mean(ranks <= order, axis=0)
+    centre = (sr + z ** 2 / (2 * numRepetitions)) / (1 + z ** 2 / numRepetitions)
+    halfWidth = z * np.sqrt(sr * (1 - sr) / numRepetitions + z ** 2 / (4 * numRepetitions ** 2)) / (1 + z ** 2 / numRepetitions)
+    return sr, centre - halfWidth, centre + halfWidth
+
+# Guessing entropy: the average rank of the correct candidate, with the
+# normal confidence interval of the mean, clipped to the possible ranks (the
+# interval is not symmetric any more when nearly all the ranks are 1)
+# ranks         - (R,s) array of ranks, see resampledRanks
+# z             - quantile of the standard normal distribution for the
+#                 confidence level
+# log2          - if True, average log2 of the ranks (guessing entropy in bits)
+# numCandidates - number of key candidates, the largest possible rank (256 for
+#                 AES, 64 for DES), None for no upper clipping
+# returns (s,) arrays of the guessing entropy and the lower and upper bounds
+def guessingEntropy(ranks, z=1.96, log2=False, numCandidates=None):
+    ranks = np.asarray(ranks, dtype='float64')
+    (lowest, highest) = (1, numCandidates)
+    if log2:
+        ranks = np.log2(ranks)
+        (lowest, highest) = (0, None if numCandidates is None else np.log2(numCandidates))
+    ge = np.mean(ranks, axis=0)
+    halfWidth = z * np.std(ranks, axis=0, ddof=1) / np.sqrt(ranks.shape[0]) if ranks.shape[0] > 1 else 0
+    return ge, np.clip(ge - halfWidth, lowest, highest), np.clip(ge + halfWidth, lowest, highest)
+
+
+#############################################################################
+### Self-tests
+
+def testGuessingEntropy():
+    ''' Confidence bounds of the guessing entropy when all the ranks but one
+        are 1, plain and in bits, and when all but one are the last rank.
+        Fails with an AssertionError.'''
+    ranks = np.ones((20, 3))
+    ranks[0] = [2, 50, 256]
+    for log2 in [False, True]:
+        (ge, low, high) = guessingEntropy(ranks, log2=log2, numCandidates=256)
+        assert np.all(low >= (0 if log2 else 1)) and np.all(low <= ge) and np.all(ge <= high)
+        assert np.all(high <= (8 if log2 else 256))
+    (ge, low, high) = guessingEntropy(257 - ranks, numCandidates=256)
+    assert np.all(high == 256) and np.all(low <= ge)
+    print("testGuessingEntropy: OK")
+
+
+#############################################################################
+### Entrypoint for self-testing
+
+if __name__ == "__main__":
+    testGuessingEntropy()
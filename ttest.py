@@ -0,0 +1,297 @@
+'''
+This file is part of pysca toolbox, license is GPLv3, see https://www.gnu.org/licenses/gpl-3.0.en.html
+Author: Ilya Kizhvatov
+Version: 1.0, 2017-05-14
+
+Leakage assessment by Welch t-test (TVLA): fixed-vs-random and specific-value
+tests, first and higher order, in a single streaming pass over the traces.
+
+Per group of traces, the count, the mean and the central sums of powers
+M_k = sum (x - mean)^k are kept per sample. The traces are processed in chunks,
+the moments of a chunk are merged into the running ones with the pairwise
+formulas of Pebay [Sandia report SAND2008-6212], which are numerically stable
+and allow to merge accumulators computed separately (e.g. on parts of a
+traceset). The higher-order tests use the centered (and standardized) products
+as in Schneider and Moradi, CHES'15 [https://eprint.iacr.org/2015/207].
+
+The traces can come from an INS TraceSet (see Trace.py) or trs file, from npz
+files (read chunk by chunk, without loading the whole traces array) or from
+any iterable of (data, traces) chunks, so the memory taken does not depend on
+the size of the traceset.
+'''
+
+import struct
+import zipfile
+import numpy as np
+
+import Trace as trs
+
+# usual threshold for |t| to report leakage
+tvlaThreshold = 4.5
+
+
+#############################################################################
+### Mergeable moments
+
+# binomial coefficient, for the merge formulas
+def binomial(n, k):
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
+
+class CentralMoments:
+    '''Count, mean and central sums of powers M_k = sum (x - mean)^k for
+       k = 2..maxPower, per sample'''
+
+    def __init__(self, traceLength, maxPower=2):
+        self.maxPower = maxPower
+        self.n = 0
+        self.mean = np.zeros(traceLength)
+        self.M = np.zeros((maxPower + 1, traceLength)) # rows 0 and 1 unused
+
+    def addTraces(self, traces):
+        '''Add a batch of traces'''
+        if len(traces) == 0:
+            return
+        chunk = CentralMoments(traces.shape[1], self.maxPower)
+        chunk.n = len(traces)
+        chunk.mean = np.mean(traces, axis=0, dtype='float64')
+        D = traces - chunk.mean
+        P = D.copy()
+        for k in range(2, self.maxPower + 1):
+            P *= D
+            chunk.M[k] = np.sum(P, axis=0)
+        self.merge(chunk)
+
+    def merge(self, other):
+        '''Merge the moments of another set of traces into these'''
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.n = other.n
+            self.mean = other.mean.copy()
+            self.M = other.M.copy()
+            return
+        (na, nb) = (np.double(self.n), np.double(other.n))
+        n = na + nb
+        delta = other.mean - self.mean
+        M = np.zeros_like(self.M)
+        for p in range(2, self.maxPower + 1):
+            M[p] = self.M[p] + other.M[p]
+            for k in range(1, p - 1):
+                M[p] += binomial(p, k) * delta ** k * ((-nb / n) ** k * self.M[p - k] + (na / n) ** k * other.M[p - k])
+            M[p] += (na * nb / n * delta) ** p * (1 / nb ** (p - 1) - (-1 / na) ** (p - 1))
+        self.n += other.n
+        self.mean += delta * (nb / n)
+        self.M = M
+
+    def centralMoment(self, k):
+        '''Return the k-th central moment per sample'''
+        return self.M[k] / self.n
+
+    def preprocessedMoments(self, order):
+        '''Return mean and variance of the traces preprocessed for the test
+           of the given order (the variances are the biased ones, over n):
+           as is for the first order, centered product
+           (x - mean)^order for the second order, and standardized product
+           ((x - mean) / std)^order for higher orders'''
+        if order == 1:
+            return self.mean, self.centralMoment(2)
+        mean = self.centralMoment(order)
+        variance = self.centralMoment(2 * order) - mean ** 2
+        if order > 2:
+            variance2 = self.centralMoment(2)
+            mean = mean / variance2 ** (order / 2.0)
+            variance = variance / variance2 ** order
+        return mean, variance
+
+class TTestAccumulator:
+    '''Welch t-test between two groups of traces (group 0 and group 1), up to
+       the given order, on the moments accumulated so far'''
+
+    def __init__(self, traceLength, maxOrder=1):
+        self.maxOrder = maxOrder
+        self.groups = [CentralMoments(traceLength, 2 * maxOrder), CentralMoments(traceLength, 2 * maxOrder)]
+
+    def addTraces(self, traces, groups):
+        '''Add a batch of traces, groups is an array of 0/1 group per trace'''
+        groups = np.asarray(groups)
+        for g in range(2):
+            self.groups[g].addTraces(traces[groups == g])
+
+    def merge(self, other):
+        '''Merge another accumulator (e.g. over another part of the traceset)'''
+        for g in range(2):
+            self.groups[g].merge(other.groups[g])
+
+    def getT(self, order=1):
+        '''Return the t-statistic per sample for the given order'''
+        (mean0, variance0) = self.groups[0].preprocessedMoments(order)
+        (mean1, variance1) = self.groups[1].preprocessedMoments(order)
+        return (mean0 - mean1) / np.sqrt(variance0 / self.groups[0].n + variance1 / self.groups[1].n)
+
+
+#############################################################################
+### Groups
+
+# Group function for the fixed-vs-random test: group 0 for the traces with
+# the fixed input, group 1 for the random ones
+# fixedData - the fixed input bytes, compared to the first bytes of the data
+def fixedVsRandom(fixedData):
+    fixedData = np.asarray(fixedData, dtype='uint8')
+    return lambda data: np.where(np.all(data[:, :len(fixedData)] == fixedData, axis=1), 0, 1)
+
+# Group function for the specific-value test: group 0 for the traces where the
+# intermediate value (masked) equals the given value, group 1 for the others
+# intermediateFunction - function like sBoxOut in lracpa
+# byteNumber           - byte of the data to compute the intermediate value from
+# keyByte              - the known key byte
+# value                - the value of the intermediate (after masking)
+# mask                 - mask of the bits tested, e.g. 0x01 for one bit
+def specificValue(intermediateFunction, byteNumber, keyByte, value, mask=0xff):
+    return lambda data: np.where((intermediateFunction(data[:, byteNumber], keyByte) & mask) == value, 0, 1)
+
+
+#############################################################################
+### Streaming over tracesets
+
+# Chunks of an npz traceset, reading the traces array from the archive piece
+# by piece (the data array is loaded as a whole), from trace firstTrace on.
+# The traces before firstTrace are seeked over when the array is stored
+# uncompressed (np.savez), and read and dropped for np.savez_compressed.
+def npzChunks(filename, chunkSize, sampleRange=None, firstTrace=0):
+    data = np.load(filename)['data']
+    archive = zipfile.ZipFile(filename)
+    f = None
+    try:
+        info = archive.getinfo('traces.npy')
+        stored = info.compress_type == zipfile.ZIP_STORED
+        if stored:
+            # the member is a plain part of the file, after its local header
+            f = open(filename, 'rb')
+            f.seek(info.header_offset)
+            (nameLength, extraLength) = struct.unpack('<HH', f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + nameLength + extraLength)
+        else:
+            f = archive.open(info)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            (shape, fortranOrder, dtype) = np.lib.format.read_array_header_1_0(f)
+        else:
+            (shape, fortranOrder, dtype) = np.lib.format.read_array_header_2_0(f)
+        if fortranOrder:
+            raise ValueError("traces in %s are in Fortran order, cannot be read by chunks" % filename)
+        rowBytes = dtype.itemsize * int(np.prod(shape[1:]))
+        if stored:
+            f.seek(min(firstTrace, shape[0]) * rowBytes, 1)
+        else:
+            for first in range(0, min(firstTrace, shape[0]), chunkSize):
+                f.read(min(chunkSize, firstTrace - first) * rowBytes) # skip, the member is not seekable
+        for first in range(firstTrace, shape[0], chunkSize):
+            count = min(chunkSize, shape[0] - first)
+            traces = np.frombuffer(f.read(count * rowBytes), dtype=dtype).reshape((count,) + tuple(shape[1:]))
+            if sampleRange is not None:
+                traces = traces[:, sampleRange[0]:sampleRange[1]]
+            yield data[first:first + count], traces
+    finally:
+        if f is not None:
+            f.close()
+        archive.close()
+
+# Chunks of (data, traces) from a traceset source
+# source      - an opened Trace.TraceSet, a trs or npz file name, a (data,
+#               traces) tuple of arrays, a list of these, or an iterable (like
+#               a generator) of (data, traces) chunks
+# chunkSize   - number of traces per chunk
+# sampleRange - optional range of samples (low, high)
+# firstTrace  - number of traces to skip (e.g. read before)
+def traceChunks(source, chunkSize=1000, sampleRange=None, firstTrace=0):
+    if isinstance(source, trs.TraceSet):
+        for first in range(firstTrace, source._numberOfTraces, chunkSize):
+            (data, traces) = source.getTraces(first, chunkSize)
+            if sampleRange is not None:
+                traces = traces[:, sampleRange[0]:sampleRange[1]]
+            yield data, traces
+    elif isinstance(source, str) and source.lower().endswith('.trs'):
+        traceSet = trs.TraceSet()
+        traceSet.open(source)
+        try:
+            for chunk in traceChunks(traceSet, chunkSize, sampleRange, firstTrace):
+                yield chunk
+        finally:
+            traceSet.close()
+    elif isinstance(source, str):
+        for chunk in npzChunks(source, chunkSize, sampleRange, firstTrace):
+            yield chunk
+    elif isinstance(source, tuple):
+        (data, traces) = source
+        for first in range(firstTrace, len(traces), chunkSize):
+            chunk = traces[first:first + chunkSize]
+            if sampleRange is not None:
+                chunk = chunk[:, sampleRange[0]:sampleRange[1]]
+            yield data[first:first + chunkSize], chunk
+    elif isinstance(source, list):
+        for s in source:
+            for chunk in traceChunks(s, chunkSize, sampleRange):
+                if firstTrace >= len(chunk[1]):
+                    firstTrace -= len(chunk[1])
+                    continue
+                yield chunk[0][firstTrace:], chunk[1][firstTrace:]
+                firstTrace = 0
+    else:
+        for (data, traces) in source:
+            if firstTrace >= len(traces):
+                firstTrace -= len(traces)
+                continue
+            if sampleRange is not None:
+                traces = traces[:, sampleRange[0]:sampleRange[1]]
+            yield data[firstTrace:], traces[firstTrace:]
+            firstTrace = 0
+
+# Welch t-test in one pass over a traceset
+# source        - traceset source, see traceChunks
+# groupFunction - function of a (c,d) data chunk returning the group (0 or 1) of
+#                 every trace, like fixedVsRandom or specificValue above
+# maxOrder      - highest order of the test
+# chunkSize     - number of traces processed at once
+# sampleRange   - optional range of samples (low, high)
+# returns (maxOrder,t) array of t-statistics of orders 1..maxOrder, and the
+# accumulator (to merge with, or add more traces to)
+def welchTTest(source, groupFunction, maxOrder=1, chunkSize=1000, sampleRange=None):
+    accumulator = None
+    for (data, traces) in traceChunks(source, chunkSize, sampleRange):
+        if accumulator is None:
+            accumulator = TTestAccumulator(traces.shape[1], maxOrder)
+        accumulator.addTraces(traces, groupFunction(data))
+    tValues = np.array([accumulator.getT(order) for order in range(1, maxOrder + 1)])
+    return tValues, accumulator
+
+
+##############################################################################
+# Self-tests
+
+def testTraceChunks():
+    ''' Read the same traces as one tuple, as a list of tuples and as a
+        generator of chunks, with a sample range and traces skipped, and
+        compare against slicing the arrays. Fails with an AssertionError.'''
+    data = np.arange(25, dtype='uint8').reshape(25, 1)
+    traces = np.arange(250, dtype='float64').reshape(25, 10)
+    shards = [(data[0:7], traces[0:7]), (data[7:20], traces[7:20]), (data[20:25], traces[20:25])]
+    for sampleRange in [None, (3, 5)]:
+        low, high = (0, 10) if sampleRange is None else sampleRange
+        for firstTrace in [0, 3, 7, 12, 24, 25]:
+            for source in [(data, traces), shards, iter(shards)]:
+                chunks = list(traceChunks(source, 4, sampleRange, firstTrace))
+                readData = np.concatenate([d for (d, t) in chunks]) if chunks else data[25:]
+                readTraces = np.concatenate([t for (d, t) in chunks]) if chunks else traces[25:, low:high]
+                assert np.array_equal(readData, data[firstTrace:])
+                assert np.array_equal(readTraces, traces[firstTrace:, low:high])
+    print("testTraceChunks: OK")
+
+
+##############################################################################
+# Entrypoint for self-testing
+
+if __name__ == "__main__":
+    testTraceChunks()